@@ -0,0 +1,63 @@
+"""Benchmark of the import time of the utils modules.
+
+Imports each module in a fresh interpreter, a few times, and reports the
+fastest wall time together with the plotting backends that were loaded.
+Importing utils.plot_functions should not load any of them.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_imports --repeat 5
+"""
+""" Importing packages """
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = [
+    "utils.const",
+    "utils.help_functions",
+    "utils.cube",
+    "utils.geo",
+    "utils.make_data",
+    "utils.plot_functions",
+]
+BACKENDS = ["plotly", "bokeh", "calplot", "seaborn", "matplotlib"]
+
+# Run in the fresh interpreter, prints the import time and the loaded backends
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [b for b in {backends!r} if b in sys.modules]]))
+"""
+
+
+def time_import(module: str):
+    """Import time in seconds of module in a new interpreter and the plotting
+    backends it loaded"""
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(module=module, backends=BACKENDS)],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    print(f"{'Module':<24}{'Import (s)':>12}  Backends loaded")
+    for module in args.modules:
+        results = [time_import(module) for _ in range(args.repeat)]
+        seconds = min(r[0] for r in results)
+        backends = ", ".join(results[0][1]) or "-"
+        print(f"{module:<24}{seconds:>12.3f}  {backends}")
+
+
+if __name__ == "__main__":
+    main()
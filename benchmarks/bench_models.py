@@ -0,0 +1,82 @@
+"""Benchmark of the response time models in src/machine_learning.py.
+
+Holds out part of the cleaned 2017-2022 data and compares the bootstrap
+random forests on sampled rows against gradient boosting on all training
+rows, on fit time and on the R^2 and mean absolute error of the held out
+rows. The random forest accuracy is that of the first bootstrap forest.
+
+Run from the root of the repository, with the data in data/:
+    python -m benchmarks.bench_models --iterations 10 --sample-size 100000
+"""
+""" Importing packages """
+import argparse
+import time
+import numpy as np
+
+# Local
+from utils.make_data import get_clean_data, get_neighborhoods, filter_data_years
+from utils.features import build_design_matrix
+from utils.importance import bootstrap_importances, bootstrap_seeds, fit_forest
+from utils.boosting import boosting_features, fit_boosting
+
+CATEGORICAL_FEATURES = ["neighborhood", "period_of_day"]
+NUMERIC_FEATURES = ["Year"]
+
+
+def scores(y_true: np.ndarray, y_pred: np.ndarray):
+    """R^2 and mean absolute error"""
+    from sklearn.metrics import mean_absolute_error, r2_score
+
+    return r2_score(y_true, y_pred), mean_absolute_error(y_true, y_pred)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--sample-size", type=int, default=100000)
+    parser.add_argument("--test-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=123)
+    args = parser.parse_args()
+
+    dat = filter_data_years(get_clean_data(get_neighborhoods()), 2017, 2023).copy()
+    dat["Year"] = dat["call_date"].dt.year
+    y = dat["response_time"].to_numpy(dtype=np.float64)
+    rng = np.random.default_rng(args.seed)
+    test = rng.random(len(dat)) < args.test_share
+    train = ~test
+
+    # Bootstrap random forests on one-hot features
+    X_rf, _ = build_design_matrix(dat, CATEGORICAL_FEATURES, NUMERIC_FEATURES)
+    start = time.perf_counter()
+    bootstrap_importances(
+        X_rf[train],
+        y[train],
+        n_iterations=args.iterations,
+        sample_size=args.sample_size,
+        seed=args.seed,
+    )
+    time_rf = time.perf_counter() - start
+    # Refit the first bootstrap forest, on the same sample with the same seed
+    first_seed = bootstrap_seeds(args.seed, args.iterations)[0]
+    forest = fit_forest(X_rf[train], y[train], first_seed, args.sample_size)
+    r2_rf, mae_rf = scores(y[test], forest.predict(X_rf[test]))
+
+    # Gradient boosting on all training rows with native categorical features
+    X_boost, _, is_categorical = boosting_features(
+        dat, CATEGORICAL_FEATURES, NUMERIC_FEATURES
+    )
+    start = time.perf_counter()
+    model = fit_boosting(X_boost[train], y[train], is_categorical, seed=args.seed)
+    time_boost = time.perf_counter() - start
+    r2_boost, mae_boost = scores(y[test], model.predict(X_boost[test]))
+
+    print(f"Training rows: {train.sum()}, test rows: {test.sum()}")
+    print(f"{'Model':<44}{'Fit (s)':>9}{'R^2':>9}{'MAE':>9}")
+    rf_name = f"Random forest, {args.iterations} x {args.sample_size} rows"
+    print(f"{rf_name:<44}{time_rf:>9.1f}{r2_rf:>9.4f}{mae_rf:>9.3f}")
+    boost_name = "Gradient boosting, all rows"
+    print(f"{boost_name:<44}{time_boost:>9.1f}{r2_boost:>9.4f}{mae_boost:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark of the date parsing in create_data.
+
+Writes a synthetic file with the *DtTm columns of the raw data, where the
+timestamps repeat over the units of an incident, and compares converting the
+columns one after another with pd.to_datetime against parse_date_columns.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_parse_dates --rows 2000000
+"""
+""" Importing packages """
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# Local
+from utils.make_data import DATE_FORMATS
+from utils.parse_dates import parse_date_columns
+
+DTTM_COLUMNS = [c for c in DATE_FORMATS if c.endswith("DtTm")]
+
+
+def make_date_file(path: str, n_rows: int, seed: int = 0):
+    """Write a csv file with n_rows rows of the *DtTm columns"""
+    rng = np.random.default_rng(seed)
+    # About two units per incident, all units share the received time
+    incident = np.sort(rng.integers(0, n_rows // 2, n_rows))
+    received = np.datetime64("2012-01-01") + rng.integers(
+        0, 11 * 365 * 24 * 3600, n_rows // 2
+    ).astype("timedelta64[s]")
+    times = received[incident]
+    dat = {}
+    for column in DTTM_COLUMNS:
+        # Later columns are a few minutes after the previous one, per incident
+        times = times + rng.integers(0, 300, n_rows // 2)[incident].astype(
+            "timedelta64[s]"
+        )
+        dat[column] = pd.Series(times).dt.strftime(DATE_FORMATS[column])
+        dat[column] = dat[column].mask(rng.random(n_rows) < 0.05)
+    pd.DataFrame(dat).to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    formats = {c: DATE_FORMATS[c] for c in DTTM_COLUMNS}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "dates.csv")
+        make_date_file(path, args.rows)
+        dat = pd.read_csv(path, dtype=str)
+
+    # Current approach: one pd.to_datetime call per column
+    start = time.perf_counter()
+    expected = dat.copy()
+    for column, date_format in formats.items():
+        expected[column] = pd.to_datetime(expected[column], format=date_format)
+    time_columns = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = parse_date_columns(dat.copy(), formats, n_jobs=args.n_jobs)
+    time_engine = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(result, expected)
+    print(f"Rows: {args.rows}")
+    print(f"pd.to_datetime per column: {time_columns:.2f} s")
+    print(f"parse_date_columns: {time_engine:.2f} s")
+    print(f"Speedup: {time_columns / time_engine:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Benchmark of the whole pipeline on synthetic data at several sizes.
+
+For each number of rows, writes the synthetic raw data from
+benchmarks/synthetic.py to a temporary folder and runs the stages of the
+pipeline on it one after another, from creating the clean data to building the
+figures. Each stage is timed, and its memory is measured as the highest
+resident memory of the process while it runs and the growth over the memory
+it started with. The results are printed and written to a json report.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_pipeline --rows 100000 1000000 --output report.json
+"""
+""" Importing packages """
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# Local
+from benchmarks.synthetic import write_synthetic_data
+from utils.make_data import (
+    create_data,
+    get_data,
+    get_neighborhoods,
+    get_hospitals,
+    clean_data,
+    fill_neighborhoods,
+    add_nearest_hospital,
+    filter_data_years,
+)
+from utils.cube import build_cube, daily_series, CUBE_METRICS
+from utils.sketch import build_sketch
+from utils.plot_functions import make_map, make_bokeh_line_plot, make_cal_plot
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def resident_memory() -> int:
+    """Resident memory of this process in bytes, or the highest resident memory
+    so far where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        import resource
+
+        # Kilobytes on Linux, bytes on macOS
+        scale = 1 if platform.system() == "Darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class MemorySampler:
+    """Highest resident memory while the with block runs, sampled every
+    interval seconds in a thread"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+
+    def __enter__(self):
+        self.start = self.peak = resident_memory()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, resident_memory())
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, resident_memory())
+
+
+def run_stage(results: list, n_rows: int, stage: str, function, *args, **kwargs):
+    """Run function(*args, **kwargs), add its time and memory to results and
+    return its result"""
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+    results.append(
+        {
+            "rows": n_rows,
+            "stage": stage,
+            "seconds": round(seconds, 4),
+            "cpu_seconds": round(cpu_seconds, 4),
+            "peak_mb": round(memory.peak / 1024**2, 1),
+            "added_mb": round((memory.peak - memory.start) / 1024**2, 1),
+            "rows_out": len(result) if isinstance(result, pd.DataFrame) else None,
+        }
+    )
+    print(
+        f"{n_rows:>10}  {stage:<22}{seconds:>9.2f}{cpu_seconds:>9.2f}"
+        f"{results[-1]['peak_mb']:>10.0f}{results[-1]['added_mb']:>10.0f}"
+    )
+    return result
+
+
+def run_pipeline(n_rows: int, chunksize: int, results: list):
+    """Run the stages of the pipeline on n_rows rows of synthetic data, in the
+    current folder"""
+    run_stage(results, n_rows, "generate", write_synthetic_data, n_rows, 0, chunksize)
+    run_stage(results, n_rows, "create_data", create_data, chunksize=chunksize)
+    dat = run_stage(results, n_rows, "get_data", get_data)
+    neighborhoods = run_stage(results, n_rows, "get_neighborhoods", get_neighborhoods)
+    hospitals = run_stage(results, n_rows, "get_hospitals", get_hospitals)
+    dat = run_stage(results, n_rows, "clean_data", clean_data, dat)
+    dat = run_stage(
+        results, n_rows, "fill_neighborhoods", fill_neighborhoods, dat, neighborhoods
+    )
+    dat = run_stage(
+        results, n_rows, "add_nearest_hospital", add_nearest_hospital, dat, hospitals
+    )
+    dat = run_stage(
+        results, n_rows, "filter_data_years", filter_data_years, dat, 2017, 2023
+    )
+    cube = run_stage(results, n_rows, "build_cube", build_cube, dat, CUBE_METRICS)
+    daily = run_stage(
+        results, n_rows, "daily_series", daily_series, cube, ["Medical Incident"]
+    )
+    run_stage(
+        results,
+        n_rows,
+        "build_sketch",
+        build_sketch,
+        dat,
+        ["call_type", "neighborhood"],
+    )
+    run_stage(results, n_rows, "make_map", make_map, cube, neighborhoods)
+    run_stage(results, n_rows, "make_bokeh_line_plot", make_bokeh_line_plot, cube)
+    fig = run_stage(results, n_rows, "make_cal_plot", make_cal_plot, daily)
+
+    import matplotlib.pyplot as plt
+
+    plt.close(fig)
+
+
+def git_commit() -> str:
+    """Commit of the code that was benchmarked"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--chunksize", type=int, default=1000000)
+    parser.add_argument("--output", default="pipeline_benchmark.json")
+    args = parser.parse_args()
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+    output = os.path.abspath(args.output)
+    cwd = os.getcwd()
+    results = []
+    print(f"{'Rows':>10}  {'Stage':<22}{'Wall (s)':>9}{'CPU (s)':>9}", end="")
+    print(f"{'Peak (MB)':>10}{'Added (MB)':>10}")
+    for n_rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            # The data paths in utils/const.py are relative to the current folder
+            os.chdir(tmp)
+            try:
+                run_pipeline(n_rows, args.chunksize, results)
+            finally:
+                os.chdir(cwd)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "versions": {"pandas": pd.__version__, "numpy": np.__version__},
+        "chunksize": args.chunksize,
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+"""Deterministic synthetic version of the raw fire incident export.
+
+Writes data/fireIncidents.csv with the columns, date formats and case_location
+format of the real export and realistic numbers of distinct values, together
+with neighborhood polygons (a grid over San Francisco) and a hospitals file,
+so the whole pipeline can run without the real data. The raw file is written
+in chunks, so any size from 100k to 50M rows fits in memory, and the same
+seed and size always give the same files.
+
+Run from the root of the repository. The files go to a new temporary folder
+unless --out is given, then the pipeline can be run from that folder. Files
+that are already there (such as real data) are only overwritten with --force:
+    python -m benchmarks.synthetic --rows 1000000 --out /tmp/fire
+"""
+""" Importing packages """
+import argparse
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Local
+from utils.const import RAW_DATA_PATH, NEIGHBORHOODS_PATH, HOSPITALS_PATH
+from utils.parse_dates import DIRECTIVE_WIDTHS, _split_format
+
+# Formats of the dates in the export
+DATE_FORMAT = "%m/%d/%Y"
+DTTM_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+# Bounding box of the incident locations
+LONGITUDE = (-122.515, -122.357)
+LATITUDE = (37.708, 37.833)
+
+NEIGHBORHOODS = [
+    "Bayview Hunters Point",
+    "Bernal Heights",
+    "Castro/Upper Market",
+    "Chinatown",
+    "Excelsior",
+    "Financial District/South Beach",
+    "Glen Park",
+    "Golden Gate Park",
+    "Haight Ashbury",
+    "Hayes Valley",
+    "Inner Richmond",
+    "Inner Sunset",
+    "Japantown",
+    "Lakeshore",
+    "Lincoln Park",
+    "Lone Mountain/USF",
+    "Marina",
+    "McLaren Park",
+    "Mission",
+    "Mission Bay",
+    "Nob Hill",
+    "Noe Valley",
+    "North Beach",
+    "Oceanview/Merced/Ingleside",
+    "Outer Mission",
+    "Outer Richmond",
+    "Pacific Heights",
+    "Portola",
+    "Potrero Hill",
+    "Presidio",
+    "Presidio Heights",
+    "Russian Hill",
+    "Seacliff",
+    "South of Market",
+    "Sunset/Parkside",
+    "Tenderloin",
+    "Treasure Island",
+    "Twin Peaks",
+    "Visitacion Valley",
+    "West of Twin Peaks",
+    "Western Addition",
+]
+# The neighborhoods are cells of a grid with this many columns
+GRID_COLUMNS = 7
+
+# Call types and how often they occur
+CALL_TYPES = {
+    "Medical Incident": 0.66,
+    "Alarms": 0.1,
+    "Structure Fire": 0.06,
+    "Traffic Collision": 0.04,
+    "Other": 0.025,
+    "Citizen Assist / Service Call": 0.025,
+    "Outside Fire": 0.02,
+    "Water Rescue": 0.008,
+    "Gas Leak (Natural and LP Gases)": 0.008,
+    "Vehicle Fire": 0.008,
+    "Electrical Hazard": 0.007,
+    "Elevator / Escalator Rescue": 0.007,
+    "Smoke Investigation (Outside)": 0.006,
+    "Odor (Strange / Unknown)": 0.005,
+    "Fuel Spill": 0.003,
+    "HazMat": 0.002,
+    "Train / Rail Incident": 0.002,
+    "Industrial Accidents": 0.001,
+    "Explosion": 0.001,
+    "Extrication / Entrapped (Machinery, Vehicle)": 0.001,
+    "Assist Police": 0.001,
+    "Structure Fire / Smoke in Building": 0.001,
+    "Confined Space / Structure Collapse": 0.0005,
+    "Train / Rail Fire": 0.0005,
+    "Suspicious Package": 0.0005,
+    "High Angle Rescue": 0.0005,
+    "Marine Fire": 0.0005,
+    "Mutual Aid / Assist Outside Agent": 0.0005,
+    "Watercraft in Distress": 0.0005,
+    "Aircraft Emergency": 0.0005,
+}
+CALL_TYPE_GROUPS = [
+    "Potentially Life-Threatening",
+    "Non Life-threatening",
+    "Alarm",
+    "Fire",
+]
+DISPOSITIONS = {
+    "Code 2 Transport": 0.3,
+    "Code 3 Transport": 0.08,
+    "Fire": 0.25,
+    "Patient Declined Transport": 0.06,
+    "No Merit": 0.05,
+    "Against Medical Advice": 0.04,
+    "Other": 0.08,
+    "Unable to Locate": 0.02,
+    "Gone on Arrival": 0.03,
+    "Medical Examiner": 0.01,
+    "Cancelled": 0.05,
+    "Duplicate": 0.02,
+    "Multi-casualty Incident": 0.01,
+}
+UNIT_TYPES = {
+    "ENGINE": 0.4,
+    "MEDIC": 0.3,
+    "TRUCK": 0.1,
+    "CHIEF": 0.08,
+    "PRIVATE": 0.05,
+    "RESCUE CAPTAIN": 0.03,
+    "RESCUE SQUAD": 0.02,
+    "SUPPORT": 0.01,
+    "INVESTIGATION": 0.01,
+}
+# Prefix and number of units of each unit type
+UNIT_PREFIXES = {
+    "ENGINE": ("E", 44),
+    "MEDIC": ("M", 99),
+    "TRUCK": ("T", 19),
+    "CHIEF": ("B", 10),
+    "PRIVATE": ("AM", 120),
+    "RESCUE CAPTAIN": ("RC", 4),
+    "RESCUE SQUAD": ("RS", 2),
+    "SUPPORT": ("SUP", 5),
+    "INVESTIGATION": ("INV", 3),
+}
+STREETS = [
+    "MARKET ST",
+    "MISSION ST",
+    "VALENCIA ST",
+    "GEARY BLVD",
+    "VAN NESS AVE",
+    "FOLSOM ST",
+    "HOWARD ST",
+    "BRYANT ST",
+    "3RD ST",
+    "24TH ST",
+    "16TH ST",
+    "CALIFORNIA ST",
+    "BROADWAY",
+    "LOMBARD ST",
+    "IRVING ST",
+    "JUDAH ST",
+    "TARAVAL ST",
+    "OCEAN AVE",
+    "GENEVA AVE",
+    "SAN BRUNO AVE",
+]
+HOSPITALS = [
+    ("San Francisco General Hospital", 37.7557, -122.4048),
+    ("California Pacific Medical Center - Van Ness Campus", 37.7858, -122.4222),
+    ("California Pacific Medical Center - Mission Bernal", 37.7474, -122.4202),
+    ("UCSF Medical Center at Parnassus", 37.7631, -122.4580),
+    ("UCSF Medical Center at Mission Bay", 37.7680, -122.3893),
+    ("Kaiser Permanente San Francisco", 37.7829, -122.4426),
+    ("Saint Francis Memorial Hospital", 37.7893, -122.4156),
+    ("St. Mary's Medical Center", 37.7740, -122.4537),
+    ("Chinese Hospital", 37.7960, -122.4087),
+    ("Veterans Affairs Medical Center", 37.7824, -122.5048),
+]
+
+
+def format_dates(times: np.ndarray, date_format: str) -> np.ndarray:
+    """Format datetime64 values with a fixed width format such as
+    "%m/%d/%Y %I:%M:%S %p", like strftime but vectorized. NaT gives None"""
+    tokens, width = _split_format(date_format)
+    times = times.astype("datetime64[s]")
+    missing = np.isnat(times)
+    times = np.where(missing, np.datetime64(0, "s"), times)
+
+    days = times.astype("datetime64[D]")
+    months = times.astype("datetime64[M]")
+    seconds = (times - days).astype(np.int64)
+    hour = seconds // 3600
+    fields = {
+        "Y": times.astype("datetime64[Y]").astype(np.int64) + 1970,
+        "m": months.astype(np.int64) % 12 + 1,
+        "d": (days - months.astype("datetime64[D]")).astype(np.int64) + 1,
+        "H": hour,
+        "I": (hour + 11) % 12 + 1,
+        "M": seconds // 60 % 60,
+        "S": seconds % 60,
+    }
+
+    chars = np.zeros((len(times), width), dtype=np.uint8)
+    for directive, position, literal in tokens:
+        if directive is None:
+            chars[:, position] = ord(literal)
+        elif directive == "p":
+            chars[:, position] = np.where(hour < 12, ord("A"), ord("P"))
+            chars[:, position + 1] = ord("M")
+        else:
+            value = fields[directive]
+            for digit in range(DIRECTIVE_WIDTHS[directive] - 1, -1, -1):
+                chars[:, position + digit] = ord("0") + value % 10
+                value = value // 10
+
+    strings = chars.view(f"S{width}").ravel().astype(f"U{width}").astype(object)
+    strings[missing] = None
+    return strings
+
+
+def _choice(rng, values: dict, n: int) -> np.ndarray:
+    """n random keys of values, with the values as probabilities"""
+    p = np.array(list(values.values()))
+    return np.array(list(values), dtype=object)[rng.choice(len(p), n, p=p / p.sum())]
+
+
+def _minutes(rng, n: int, mean: float) -> np.ndarray:
+    """Random durations with a long right tail, as timedelta64[s]"""
+    return (rng.gamma(2.0, mean / 2.0, n) * 60).astype("timedelta64[s]")
+
+
+def make_chunk(n_rows: int, start: int = 0, seed: int = 0) -> pd.DataFrame:
+    """n_rows rows of the synthetic export, starting at row start. Each chunk
+    has its own random state and its own incidents, so chunks can be made
+    separately"""
+    rng = np.random.default_rng([seed, start])
+    # Units per incident, mostly one or two and sometimes many
+    units = np.minimum(rng.geometric(0.45, n_rows), 12)
+    units = units[np.cumsum(units) <= n_rows]
+    units = np.append(units, n_rows - units.sum())
+    units = units[units > 0]
+    n_incidents = len(units)
+    incident = np.repeat(np.arange(n_incidents), units)
+    sequence = np.arange(n_rows) - np.repeat(np.cumsum(units) - units, units) + 1
+
+    # Incident level values
+    incident_number = 10000000 + start + np.arange(n_incidents)
+    received = np.datetime64("2010-01-01T00:00:00") + rng.integers(
+        0, 13 * 365 * 86400, n_incidents
+    ).astype("timedelta64[s]")
+    call_type = _choice(rng, CALL_TYPES, n_incidents)
+    longitude = rng.uniform(*LONGITUDE, n_incidents)
+    latitude = rng.uniform(*LATITUDE, n_incidents)
+    location = np.array(
+        [f"POINT ({lon:.6f} {lat:.6f})" for lon, lat in zip(longitude, latitude)],
+        dtype=object,
+    )
+    location[rng.random(n_incidents) < 0.005] = None
+    neighborhood = _neighborhood_codes(latitude, longitude)
+    neighborhood[rng.random(n_incidents) < 0.01] = -1
+    box = rng.integers(1000, 9999, n_incidents)
+    block = rng.integers(0, 40, n_incidents) * 100
+    street = np.array(STREETS, dtype=object)[rng.integers(0, len(STREETS), n_incidents)]
+    address = np.char.add(
+        np.char.add(block.astype(str), " Block of "), street.astype(str)
+    )
+
+    # Unit level times, each step after the previous one
+    received = received[incident]
+    entry = received + _minutes(rng, n_rows, 0.8)
+    dispatch = entry + _minutes(rng, n_rows, 0.6)
+    response = dispatch + _minutes(rng, n_rows, 0.3)
+    on_scene = response + _minutes(rng, n_rows, 6)
+    transported = rng.random(n_rows) < 0.25
+    transport = np.where(
+        transported, on_scene + _minutes(rng, n_rows, 15), np.datetime64("NaT")
+    )
+    hospital = np.where(
+        transported, transport + _minutes(rng, n_rows, 12), np.datetime64("NaT")
+    )
+    available = np.where(transported, hospital, on_scene) + _minutes(rng, n_rows, 20)
+    # Some units never arrive, and a few times are recorded out of order
+    on_scene = np.where(rng.random(n_rows) < 0.12, np.datetime64("NaT"), on_scene)
+    flipped = rng.random(n_rows) < 0.002
+    on_scene[flipped] = received[flipped] - _minutes(rng, flipped.sum(), 1)
+
+    unit_type = _choice(rng, UNIT_TYPES, n_rows)
+    # Units of the same type in an incident get consecutive numbers, so they
+    # only repeat when an incident has more of them than there are
+    rank = pd.Series(incident).groupby([incident, unit_type]).cumcount().to_numpy()
+    unit_id = np.empty(n_rows, dtype=object)
+    for name, (prefix, count) in UNIT_PREFIXES.items():
+        of_type = unit_type == name
+        number = (incident_number[incident] + rank)[of_type] % count + 1
+        unit_id[of_type] = np.char.add(prefix, np.char.zfill(number.astype(str), 2))
+    call_number = incident_number * 3 + 1
+
+    dat = {
+        "Call Number": call_number[incident],
+        "Unit ID": unit_id,
+        "Incident Number": incident_number[incident],
+        "Call Type": call_type[incident],
+        "Call Date": format_dates(received, DATE_FORMAT),
+        "Watch Date": format_dates(received - np.timedelta64(8, "h"), DATE_FORMAT),
+    }
+    for column, times in [
+        ("Received DtTm", received),
+        ("Entry DtTm", entry),
+        ("Dispatch DtTm", dispatch),
+        ("Response DtTm", response),
+        ("On Scene DtTm", on_scene),
+        ("Transport DtTm", transport),
+        ("Hospital DtTm", hospital),
+    ]:
+        dat[column] = format_dates(times, DTTM_FORMAT)
+    dat["Call Final Disposition"] = _choice(rng, DISPOSITIONS, n_incidents)[incident]
+    dat["Available DtTm"] = format_dates(available, DTTM_FORMAT)
+    dat["Address"] = address[incident]
+    dat["City"] = np.where(
+        rng.random(n_incidents) < 0.99, "San Francisco", "Treasure Isla"
+    )[incident]
+    dat["Zipcode of Incident"] = (94102 + rng.integers(0, 33, n_incidents))[
+        incident
+    ].astype(float)
+    dat["Battalion"] = np.char.add("B", np.char.zfill((box % 10 + 1).astype(str), 2))[
+        incident
+    ]
+    dat["Station Area"] = np.char.zfill((box % 51 + 1).astype(str), 2)[incident]
+    dat["Box"] = box.astype(str)[incident]
+    priority = rng.choice(
+        ["2", "3", "E", "A", "I"], n_incidents, p=[0.4, 0.45, 0.1, 0.03, 0.02]
+    )
+    dat["Original Priority"] = priority[incident]
+    dat["Priority"] = np.where(priority == "E", "3", priority)[incident]
+    dat["Final Priority"] = np.where(priority == "2", 2, 3)[incident]
+    dat["ALS Unit"] = rng.random(n_rows) < 0.6
+    dat["Call Type Group"] = np.array(CALL_TYPE_GROUPS + [None], dtype=object)[
+        rng.integers(0, len(CALL_TYPE_GROUPS) + 1, n_incidents)
+    ][incident]
+    dat["Number of Alarms"] = np.where(rng.random(n_incidents) < 0.998, 1, 2)[incident]
+    dat["Unit Type"] = unit_type
+    dat["Unit sequence in call dispatch"] = sequence
+    dat["Fire Prevention District"] = np.array(
+        [str(i) for i in range(1, 10)] + ["None"], dtype=object
+    )[box % 10][incident]
+    dat["Supervisor District"] = (box % 11 + 1).astype(float)[incident]
+    dat["Neighborhooods - Analysis Boundaries"] = np.array(
+        NEIGHBORHOODS + [None], dtype=object
+    )[neighborhood][incident]
+    dat["RowID"] = np.char.add(
+        np.char.add(call_number[incident].astype(str), "-"), unit_id.astype(str)
+    )
+    dat["case_location"] = location[incident]
+    dat["Analysis Neighborhoods"] = np.where(
+        neighborhood >= 0, neighborhood + 1.0, np.nan
+    )[incident]
+    return pd.DataFrame(dat)
+
+
+def _neighborhood_codes(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Position in NEIGHBORHOODS of the grid cell (see write_neighborhoods) of
+    each location"""
+    rows = -(-len(NEIGHBORHOODS) // GRID_COLUMNS)
+    column = ((longitude - LONGITUDE[0]) / (LONGITUDE[1] - LONGITUDE[0])) * GRID_COLUMNS
+    row = ((latitude - LATITUDE[0]) / (LATITUDE[1] - LATITUDE[0])) * rows
+    cell = np.clip(row.astype(int), 0, rows - 1) * GRID_COLUMNS + np.clip(
+        column.astype(int), 0, GRID_COLUMNS - 1
+    )
+    # The last row is not full, its missing cells belong to the last neighborhood
+    return np.minimum(cell, len(NEIGHBORHOODS) - 1)
+
+
+def write_raw_data(
+    n_rows: int, path: str = RAW_DATA_PATH, seed: int = 0, chunksize: int = 1000000
+):
+    """Write n_rows rows of synthetic raw data to path, chunksize rows at a time"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    for start in range(0, n_rows, chunksize):
+        dat = make_chunk(min(chunksize, n_rows - start), start, seed)
+        dat.to_csv(
+            path, index=False, mode="w" if start == 0 else "a", header=start == 0
+        )
+
+
+def write_neighborhoods(path: str = NEIGHBORHOODS_PATH):
+    """Write the neighborhoods as cells of a grid over the incident locations"""
+    rows = -(-len(NEIGHBORHOODS) // GRID_COLUMNS)
+    xs = np.linspace(*LONGITUDE, GRID_COLUMNS + 1).round(6)
+    ys = np.linspace(*LATITUDE, rows + 1).round(6)
+    features = []
+    for i, name in enumerate(NEIGHBORHOODS):
+        row, column = divmod(i, GRID_COLUMNS)
+        # The last neighborhood also covers the rest of the last row
+        right = xs[-1] if i == len(NEIGHBORHOODS) - 1 else xs[column + 1]
+        x0, x1, y0, y1 = xs[column], right, ys[row], ys[row + 1]
+        ring = [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+        features.append(
+            {
+                "type": "Feature",
+                "properties": {"nhood": name},
+                "geometry": {"type": "MultiPolygon", "coordinates": [[ring]]},
+            }
+        )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def write_hospitals(path: str = HOSPITALS_PATH):
+    """Write the hospitals in the format read by get_hospitals"""
+    hospitals = pd.DataFrame(
+        {
+            "Facility Name": [name for name, _, _ in HOSPITALS],
+            "Services": "Hospital",
+            "Location": [f"({lat}, {lon})" for _, lat, lon in HOSPITALS],
+        }
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    hospitals.to_csv(path, index=False)
+
+
+def synthetic_paths(out: str = ".") -> dict:
+    """Paths of the raw data, neighborhoods and hospitals files under out"""
+    return {
+        "raw": os.path.join(out, RAW_DATA_PATH),
+        "neighborhoods": os.path.join(out, NEIGHBORHOODS_PATH),
+        "hospitals": os.path.join(out, HOSPITALS_PATH),
+    }
+
+
+def write_synthetic_data(
+    n_rows: int,
+    seed: int = 0,
+    chunksize: int = 1000000,
+    out: str = ".",
+    force: bool = False,
+):
+    """Write the raw data, neighborhoods and hospitals to the data folder of
+    out. Unless force is True, raises a FileExistsError if any of the files
+    already exists instead of overwriting it"""
+    paths = synthetic_paths(out)
+    existing = [path for path in paths.values() if os.path.exists(path)]
+    if existing and not force:
+        raise FileExistsError(
+            f"Not overwriting {', '.join(existing)}, use --force to overwrite"
+        )
+    write_raw_data(n_rows, paths["raw"], seed, chunksize)
+    write_neighborhoods(paths["neighborhoods"])
+    write_hospitals(paths["hospitals"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunksize", type=int, default=1000000)
+    parser.add_argument(
+        "--out", help="folder to write data/ to, a new temporary folder by default"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="overwrite files that already exist"
+    )
+    args = parser.parse_args()
+    out = args.out or tempfile.mkdtemp(prefix="fire_synthetic_")
+    write_synthetic_data(args.rows, args.seed, args.chunksize, out, args.force)
+    print(f"Synthetic data written to {os.path.join(out, 'data')}")
+
+
+if __name__ == "__main__":
+    main()
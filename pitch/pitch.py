@@ -1,34 +1,25 @@
 """ Importing packages """
 import datetime as dt
-import pandas as pd
 import numpy as np
 from bokeh.plotting import figure, output_file, save
 import folium
 import plotly.express as px
 
-from utils.make_data import get_data
+from utils.make_data import get_neighborhoods
+from utils.incidents import get_incidents
 
 """ Importing data """
-dat = get_data()
+# One row per incident (not per dispatched unit), with its location. All
+# incidents are counted, also those clean_data drops (kept_units is 0)
+dat = get_incidents(get_neighborhoods())
 # print the names of the columns of the data
 print(dat.columns)
-# print number of rows and columns
+# print number of rows and columns, the number of incidents
 print(dat.shape)
-# Number of unique values in the column "Call Number"
-print(dat["Call Number"].nunique())
-# Unique values in the column "Call Type"
-print(dat["Call Type"].unique())
-
-""" Clean up the location data """
-# extract the latitude and longitude from the case_location column and add them as seperate columns
-location = dat["case_location"].str.extract(r"\((.+)\)")
-dat["latitude"] = location[0].str.split(" ").str[0]
-dat["longitude"] = location[0].str.split(" ").str[1]
-# convert the latitude and longitude columns to numeric
-dat["latitude"] = pd.to_numeric(dat["latitude"])
-dat["longitude"] = pd.to_numeric(dat["longitude"])
-# drop the case_location column
-dat = dat.drop(columns=["case_location"])
+# Number of unique values in the column "call_number"
+print(dat["call_number"].nunique())
+# Unique values in the column "call_type"
+print(dat["call_type"].unique())
 
 """ Create heatmap of incidents """
 # done in pitch_heatmap.ipynb
@@ -44,11 +35,10 @@ weekday_map = {
     6: "Sun",
 }
 # Create a new column with the weekday of the incident
-dat_unique = dat.drop_duplicates(subset="Incident Number")
-dat_unique["weekday"] = dat_unique["Call Date"].dt.weekday.map(weekday_map)
+dat["weekday"] = dat["call_date"].dt.weekday.map(weekday_map)
 
 fig = px.histogram(
-    dat_unique,
+    dat,
     x="weekday",
     category_orders=dict(weekday=["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]),
     labels={"weekday": "Weekday"},
@@ -59,7 +49,6 @@ fig.show()
 
 
 """ Create a histrogram of the number of incidents per district """
-dat_unique = dat.drop_duplicates(subset="Incident Number")
 # Create a histogram showing the number of incidents per district
 DISTRICTS = [
     "Tenderloin",
@@ -75,15 +64,13 @@ DISTRICTS = [
     "Outer Richmond",
 ]
 # Filter the data to only contain the districts in DISTRICTS
-dat_unique = dat_unique[
-    dat_unique["Neighborhooods - Analysis Boundaries"].isin(DISTRICTS)
-]
+dat_districts = dat[dat["neighborhood"].isin(DISTRICTS)]
 # Create a histogram showing the number of incidents per district
 
 fig = px.histogram(
-    dat_unique,
-    x="Neighborhooods - Analysis Boundaries",
-    labels={"Neighborhooods - Analysis Boundaries": "District"},
+    dat_districts,
+    x="neighborhood",
+    labels={"neighborhood": "District"},
     title="Number of incidents per district",
     color_discrete_sequence=["#FFE765"],
 ).update_layout(yaxis_title="Number of incidents")
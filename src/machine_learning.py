@@ -1,79 +1,86 @@
 """" Importing packages """
-import random
-import pandas as pd
 import numpy as np
 from bokeh.io import show, output_file
 
-# Machine learning
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import RandomForestRegressor
-
 # Local
 from utils.make_data import (
-    get_data,
-    clean_data,
+    get_clean_data,
+    get_neighborhoods,
     filter_data_years,
+    get_hospitals,
+    add_nearest_hospital,
 )
-from utils.plot_functions import plot_importance
-
+from utils.features import build_design_matrix
+from utils.importance import bootstrap_importances
+from utils.boosting import boosting_features, fit_boosting, boosting_importances
+from utils.plot_functions import plot_importance, plot_importance2
 
-""" Importing data """
-dat_raw = get_data()
-dat_all_years = clean_data(dat_raw)
-dat = filter_data_years(dat_all_years, 2017, 2023)
+# Features of the models, categorical features are one-hot encoded
+CATEGORICAL_FEATURES = ["neighborhood", "period_of_day"]
+NUMERIC_FEATURES = ["Year", "hospital_distance"]
+# Number of random forests and the number of rows each one is fitted on
+N_ITERATIONS = 10
+SAMPLE_SIZE = 100000
 
-""" Prepare the data """
-# Create the target variable and the features
-ml_dat = dat.copy()
-ml_dat["Year"] = ml_dat["call_date"].dt.year
-y = ml_dat["response_time"].reset_index(drop=True)
-X_dat = ml_dat[["neighborhood", "period_of_day", "Year"]]
-X_dat = X_dat.reset_index(drop=True)
 
-# Handle categorical variables
-X_dat = pd.get_dummies(X_dat, columns=["neighborhood", "period_of_day"])
-column_names = X_dat.columns
-# Scale the data
-scaler = StandardScaler()
-X_dat = scaler.fit_transform(X_dat)
+# The workers of bootstrap_importances may import this file, so only run the
+# analysis when it is run as a script
+if __name__ == "__main__":
+    """Importing data"""
+    # Cleaned data with missing neighborhoods filled in from the incident locations,
+    # shared with save_plots.py through the cache
+    dat_all_years = get_clean_data(get_neighborhoods())
+    # Distance from each incident to the nearest hospital
+    dat_all_years = add_nearest_hospital(dat_all_years, get_hospitals())
+    dat = filter_data_years(dat_all_years, 2017, 2023)
 
-""" Random Forest """
-random.seed(123)
-# Use bootstrapping
-n_iterations = 10
-sample_size = 100000
-importances_array = np.zeros((X_dat.shape[1], n_iterations))
+    """ Prepare the data """
+    # Create the target variable and the features
+    ml_dat = dat.copy()
+    ml_dat["Year"] = ml_dat["call_date"].dt.year
+    y = ml_dat["response_time"].reset_index(drop=True)
 
-for i in range(n_iterations):
-    # Take a sample of the data
-    sample = random.sample(range(len(X_dat)), sample_size)
-    X_dat_sample = X_dat[sample, :]
-    # Get the corresponding rows in the target variable
-    y_sample = y[sample]
+    # Sparse matrix with the scaled year and an indicator for each category
+    X_dat, column_names = build_design_matrix(
+        ml_dat, CATEGORICAL_FEATURES, NUMERIC_FEATURES
+    )
 
-    # Create the model
-    model = RandomForestRegressor(n_estimators=100, max_depth=5)
-    model.fit(X_dat_sample, y_sample)
+    """ Random Forest """
+    # Fit the forests on samples of the data in parallel
+    importances_array = bootstrap_importances(
+        X_dat,
+        y.to_numpy(),
+        n_iterations=N_ITERATIONS,
+        sample_size=SAMPLE_SIZE,
+        seed=123,
+    )
 
-    # Get the feature importances
-    importances_rf = model.feature_importances_
+    # Plot the feature importances
+    # Calculate the mean of the importances
+    importances_rf = np.mean(importances_array, axis=1)
 
-    # Add the importances to the array
-    importances_array[:, i] = model.feature_importances_
+    # Get the 10 most important features
+    indices = np.argsort(importances_rf)[::-1]
+    indices = indices[:10]
 
-# Plot the feature importances
-# Calculate the mean of the importances
-importances_rf = np.mean(importances_array, axis=1)
+    p = plot_importance(
+        column_names=column_names[indices],
+        importances=importances_rf[indices],
+        title="Feature importances according to Random Forest",
+    )
 
-# Get the 10 most important features
-indices = np.argsort(importances_rf)[::-1]
-indices = indices[:10]
+    output_file("figs/feature_importance.html")
+    show(p)
 
-p = plot_importance(
-    column_names=column_names[indices],
-    importances=importances_rf[indices],
-    title="Feature importances according to Random Forest",
-)
+    """ Gradient boosting """
+    # Fit on all rows, with native splits on the categorical features
+    X_boost, boost_names, is_categorical = boosting_features(
+        ml_dat, CATEGORICAL_FEATURES, NUMERIC_FEATURES
+    )
+    model = fit_boosting(X_boost, y.to_numpy(), is_categorical)
+    importances_boost = boosting_importances(model, X_boost, y.to_numpy(), boost_names)
+    print(importances_boost)
 
-output_file("figs/feature_importance.html")
-show(p)
+    p = plot_importance2(importances_boost)
+    output_file("figs/feature_importance_boosting.html")
+    show(p)
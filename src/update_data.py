@@ -0,0 +1,67 @@
+""" Importing packages """
+import sys
+
+# Local
+from utils.make_data import (
+    get_clean_data,
+    get_neighborhoods,
+    get_hospitals,
+    add_nearest_hospital,
+    update_data,
+    update_clean_data,
+    clean_data_key,
+)
+from utils.incidents import incidents_key, update_incidents
+from utils.cube import (
+    REPORT_CUBE_GRAIN,
+    REPORT_CUBE_METRICS,
+    build_cube,
+    cube_key,
+    load_cube,
+    save_cube,
+    update_cube,
+)
+
+
+def main(raw_path: str):
+    """Add a new raw export (e.g. the latest month) to the cleaned data"""
+    neighborhoods = get_neighborhoods()
+    hospitals = get_hospitals()
+    # Keys of the cleaned data, incident table and cube of the data as it is
+    # now, they change when the data file is rewritten
+    clean_key = clean_data_key(neighborhoods)
+    old_incidents_key = incidents_key(neighborhoods)
+    old_cube_key = cube_key(clean_key)
+
+    added, replaced = update_data(raw_path)
+    print(f"Added {len(added)} rows, of which {len(replaced)} replaced existing rows")
+    if len(added) == 0:
+        return
+
+    """ Update the cached cleaned data and incident table, not rebuild them """
+    # Only the new and replaced rows are cleaned
+    added_clean, removed_clean = update_clean_data(
+        clean_key, added, replaced, neighborhoods
+    )
+    update_incidents(old_incidents_key, added, replaced, neighborhoods)
+
+    """ Update the cube of the report figures, not rebuild it """
+    cube = load_cube(old_cube_key)
+    if cube is not None:
+        cube = update_cube(
+            cube,
+            add_nearest_hospital(added_clean, hospitals),
+            add_nearest_hospital(removed_clean, hospitals),
+        )
+    else:
+        # No cube of the data before the update, build it from all cleaned data
+        dat = add_nearest_hospital(get_clean_data(neighborhoods), hospitals)
+        cube = build_cube(dat, REPORT_CUBE_METRICS, REPORT_CUBE_GRAIN)
+    save_cube(cube, cube_key(clean_data_key(neighborhoods)))
+
+
+# Usage: python -m src.update_data data/fireIncidents_new_month.csv
+# The date parsing may start worker processes that import this file, so only
+# run the update when it is run as a script
+if __name__ == "__main__":
+    main(sys.argv[1])
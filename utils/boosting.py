@@ -0,0 +1,77 @@
+""" Importing packages """
+import numpy as np
+import pandas as pd
+
+# Largest number of categories HistGradientBoostingRegressor can handle natively
+MAX_CATEGORIES = 255
+
+
+def boosting_features(dat: pd.DataFrame, categorical: list, numeric: list = []):
+    """Feature matrix for fit_boosting with the numeric columns followed by the
+    categorical columns as category codes (NaN when missing), which the booster
+    splits on natively. Returns the matrix, the column names and a mask of the
+    categorical columns"""
+    columns = []
+    for column in numeric:
+        columns.append(dat[column].to_numpy(dtype=np.float64))
+    for column in categorical:
+        categories = dat[column].astype("category").cat
+        if len(categories.categories) > MAX_CATEGORIES:
+            raise ValueError(
+                f"{column} has more than {MAX_CATEGORIES} categories: "
+                f"{len(categories.categories)}"
+            )
+        codes = categories.codes.to_numpy().astype(np.float64)
+        codes[codes < 0] = np.nan
+        columns.append(codes)
+
+    X = np.column_stack(columns)
+    names = pd.Index(list(numeric) + list(categorical))
+    is_categorical = np.array([False] * len(numeric) + [True] * len(categorical))
+    return X, names, is_categorical
+
+
+def fit_boosting(
+    X: np.ndarray, y: np.ndarray, is_categorical: np.ndarray, seed: int = 123, **params
+):
+    """Fit a histogram based gradient boosting model on all rows of X, with
+    native splits on the categorical columns. Early stopping is off unless
+    given in params, as it would hold out part of the rows for validation"""
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    params = {"early_stopping": False, **params}
+    model = HistGradientBoostingRegressor(
+        categorical_features=is_categorical, random_state=seed, **params
+    )
+    model.fit(X, y)
+    return model
+
+
+def boosting_importances(
+    model,
+    X: np.ndarray,
+    y: np.ndarray,
+    names: list,
+    n_repeats: int = 5,
+    sample_size: int = 100000,
+    seed: int = 123,
+) -> pd.DataFrame:
+    """Permutation importances of a model from fit_boosting, in the format of
+    plot_importance2 (one row per feature, one column per method). They are
+    computed on a sample of sample_size rows of X and y with the public
+    scikit-learn API, so they do not depend on the internals of the model"""
+    from sklearn.inspection import permutation_importance
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(X), min(sample_size, len(X)), replace=False)
+    permutation = permutation_importance(
+        model,
+        X[sample],
+        y[sample],
+        n_repeats=n_repeats,
+        random_state=seed,
+    ).importances_mean
+    return pd.DataFrame(
+        {"permutation": permutation},
+        index=pd.Index(names),
+    )
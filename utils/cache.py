@@ -0,0 +1,161 @@
+""" Importing packages """
+import hashlib
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Local
+from utils.const import CACHE_DIR, CACHE_MAX_BYTES
+
+# Content hashes of files, keyed on their path, size and modification time
+FILE_HASHES = "file_hashes.json"
+
+
+def _hash_bytes(*parts) -> str:
+    """Hash of the parts, converted to text first unless they are bytes"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, default=str).encode()
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def hash_file(path: str, cache_dir: str = CACHE_DIR) -> str:
+    """Hash of the contents of a file. The hash is remembered for the file's size
+    and modification time, so an unchanged file is only read once"""
+    stat = os.stat(path)
+    stamp = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    hashes_path = os.path.join(cache_dir, FILE_HASHES)
+    hashes = {}
+    if os.path.exists(hashes_path):
+        with open(hashes_path) as f:
+            hashes = json.load(f)
+    if stamp in hashes:
+        return hashes[stamp]
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    # Only keep the latest hash of each file
+    path_prefix = stamp.rsplit(":", 2)[0] + ":"
+    hashes = {k: v for k, v in hashes.items() if not k.startswith(path_prefix)}
+    hashes[stamp] = digest.hexdigest()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(hashes_path, "w") as f:
+        json.dump(hashes, f)
+    return hashes[stamp]
+
+
+def hash_code(*paths) -> str:
+    """Hash of source files, e.g. the __file__ of the modules that build a frame"""
+    sources = []
+    for path in paths:
+        with open(path, "rb") as f:
+            sources.append(f.read())
+    return _hash_bytes(*sources)
+
+
+def cache_key(**parts) -> str:
+    """Key of a cache entry from hashes and parameters"""
+    return _hash_bytes(parts)
+
+
+def _entry_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"{key}.parquet")
+
+
+def load_cached(key: str, cache_dir: str = CACHE_DIR):
+    """Read the frame stored under key, or None if there is none. The attrs of
+    the frame are restored as well"""
+    path = _entry_path(key, cache_dir)
+    if not os.path.exists(path):
+        return None
+    table = pq.read_table(path)
+    dat = table.to_pandas()
+    metadata = table.schema.metadata
+    dat.attrs = json.loads(metadata.get(b"attrs", b"{}"))
+    # Parquet does not keep the type of the categories, only that they are text
+    for column in json.loads(metadata.get(b"string_categories", b"[]")):
+        categories = dat[column].cat.categories.astype("string")
+        dat[column] = dat[column].cat.rename_categories(categories)
+    # Mark the entry as recently used
+    os.utime(path)
+    return dat
+
+
+def save_cached(
+    key: str,
+    dat: pd.DataFrame,
+    cache_dir: str = CACHE_DIR,
+    max_bytes: int = CACHE_MAX_BYTES,
+):
+    """Store dat under key, then evict the least recently used entries until
+    the cache is at most max_bytes"""
+    os.makedirs(cache_dir, exist_ok=True)
+    table = pa.Table.from_pandas(dat)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"attrs"] = json.dumps(dat.attrs).encode()
+    metadata[b"string_categories"] = json.dumps(
+        [
+            column
+            for column, dtype in dat.dtypes.items()
+            if isinstance(dtype, pd.CategoricalDtype)
+            and pd.api.types.is_string_dtype(dtype.categories)
+            and dtype.categories.dtype != object
+        ]
+    ).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    # Write to a temporary file first so a failed write leaves no broken entry
+    path = _entry_path(key, cache_dir)
+    pq.write_table(table, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+    """Delete the least recently used entries until the cache is at most
+    max_bytes. The newest entry is always kept"""
+    entries = [
+        os.path.join(cache_dir, name)
+        for name in os.listdir(cache_dir)
+        if name.endswith((".parquet", ".json")) and name != FILE_HASHES
+    ]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    total = 0
+    for i, path in enumerate(entries):
+        total += os.path.getsize(path)
+        if i > 0 and total > max_bytes:
+            os.remove(path)
+
+
+def cached_frame(key: str, build, cache_dir: str = CACHE_DIR):
+    """Load the frame stored under key, or build it with build() and store it"""
+    dat = load_cached(key, cache_dir)
+    if dat is None:
+        dat = build()
+        save_cached(key, dat, cache_dir)
+    return dat
+
+
+def cached_json(key: str, build, cache_dir: str = CACHE_DIR):
+    """Load the JSON object stored under key, or build it with build() and store
+    it. Shares the least recently used eviction with the cached frames"""
+    path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            obj = json.load(f)
+        os.utime(path)
+        return obj
+
+    obj = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(obj, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+    evict(cache_dir)
+    return obj
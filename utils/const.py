@@ -19,3 +19,29 @@ INTERESTING_NEIGHBORHOODS = [
     "Lakeshore",
     "Mission",
 ]
+
+# Location of the raw export and the cleaned data written by create_data
+RAW_DATA_PATH = "data/fireIncidents.csv"
+CLEAN_DATA_CSV_PATH = "data/fireIncidents_clean.csv"
+CLEAN_DATA_PARQUET_PATH = "data/fireIncidents_clean.parquet"
+# Neighborhood polygons
+NEIGHBORHOODS_PATH = "data/neighborhoods.geojson"
+# Hospital locations, see get_hospitals
+HOSPITALS_PATH = "data/hospitals.csv"
+# Simplification of the polygons drawn on maps, in degrees (about 10 meters),
+# well below a pixel at the zoom of the maps
+MAP_TOLERANCE = 0.0001
+# Most points drawn per line of the line plots over months, longer lines are
+# downsampled keeping their shape, see make_bokeh_line_plot
+LINE_MAX_POINTS = 200
+# Latest Received DtTm in the cleaned data, see update_data
+WATERMARK_PATH = "data/fireIncidents_clean_watermark.json"
+# Aggregate cube of the cleaned data that the report figures are built from,
+# see get_cube in utils/cube.py
+CUBE_PATH = "data/cube.parquet"
+# Cache of cleaned data, see utils/cache.py. Least recently used entries are
+# deleted when the cache grows beyond CACHE_MAX_BYTES
+CACHE_DIR = "data/cache"
+CACHE_MAX_BYTES = 2 * 1024**3
+# Environment variable that turns on the stage trace, see utils/trace.py
+TRACE_ENV = "FIRE_TRACE"
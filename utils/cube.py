@@ -0,0 +1,242 @@
+""" Importing packages """
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Local
+from utils.cache import cache_key, hash_code, hash_file
+from utils.const import CUBE_PATH, HOSPITALS_PATH
+from utils.trace import traced
+
+# Dimensions and metrics of the aggregate cube built by build_cube. The cube
+# also has a time dimension, the first day of the day or month (the grain) of
+# received_dttm
+CUBE_DIMENSIONS = ["neighborhood", "call_type", "period_of_day"]
+CUBE_METRICS = ["response_time", "transport_time"]
+# Time dimension of the cube of each grain, with the numpy unit it is built from
+CUBE_GRAINS = {"day": ("day", "D"), "month": ("Year_month", "M")}
+# Metrics and grain of the cube stored at CUBE_PATH that the report figures
+# are built from, see get_cube. hospital_distance is added by
+# add_nearest_hospital. The per day series of the calendars are built from
+# the cleaned data instead
+REPORT_CUBE_METRICS = CUBE_METRICS + ["hospital_distance"]
+REPORT_CUBE_GRAIN = "month"
+# Columns added from the time dimension by add_cube_dates
+DATE_COLUMNS = ["Year", "month", "Year_month"]
+
+
+@traced
+def build_cube(
+    dat: pd.DataFrame, metrics: list = CUBE_METRICS, grain: str = "day"
+) -> pd.DataFrame:
+    """Aggregate the cleaned data to one row per neighborhood, call type, period
+    of day and day or month (grain, of received_dttm). For each metric the cube
+    holds the sum, the number of non-missing values and the sum of squares, so
+    means and standard deviations for any coarser grouping can be computed from
+    it, and cubes of different rows can be added together. Year, month and
+    Year_month columns are added from the day or month."""
+    values = {}
+    for metric in metrics:
+        value = dat[metric].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(value)
+        value = np.where(valid, value, 0.0)
+        values[f"{metric}_sum"] = value
+        values[f"{metric}_count"] = valid.astype(np.int64)
+        values[f"{metric}_sumsq"] = value * value
+    values["rows"] = np.ones(len(dat), dtype=np.int64)
+
+    time_column, unit = CUBE_GRAINS[grain]
+    time = dat["received_dttm"].to_numpy().astype(f"datetime64[{unit}]")
+    keys = [dat[d] for d in CUBE_DIMENSIONS]
+    keys.append(
+        pd.Series(time.astype("datetime64[ns]"), index=dat.index, name=time_column)
+    )
+    cube = (
+        pd.DataFrame(values, index=dat.index)
+        .groupby(keys, observed=True, dropna=False)
+        .sum()
+        .reset_index()
+    )
+    return add_cube_dates(cube)
+
+
+def add_cube_dates(cube: pd.DataFrame) -> pd.DataFrame:
+    """Add the Year, month and Year_month (first day of the month) columns"""
+    time = cube[CUBE_GRAINS[cube_grain(cube)][0]]
+    cube["Year"] = time.dt.year
+    cube["month"] = time.dt.month
+    cube["Year_month"] = time.dt.to_period("M").dt.to_timestamp()
+    return cube
+
+
+def cube_grain(cube: pd.DataFrame) -> str:
+    """Grain of a cube from build_cube, day or month"""
+    return "day" if "day" in cube.columns else "month"
+
+
+@traced
+def daily_series(
+    dat: pd.DataFrame, filter_call_types: list = None, metrics: list = CUBE_METRICS
+) -> pd.DataFrame:
+    """Number of rows and the sum and count of each metric per day of
+    received_dttm, only for the call types in filter_call_types if given.
+    dat can be the cleaned data or a cube from build_cube with the day grain.
+    The result has one row per day with a DatetimeIndex named day, so it stays
+    small however many rows it is built from"""
+    if is_cube(dat) and cube_grain(dat) != "day":
+        raise ValueError("A per day series needs a cube with the day grain")
+    if filter_call_types is not None:
+        dat = dat[dat["call_type"].isin(filter_call_types)]
+    columns = ["rows"] + [f"{m}_{s}" for m in metrics for s in ["sum", "count"]]
+    if is_cube(dat):
+        return dat.groupby("day")[columns].sum()
+
+    day = dat["received_dttm"].to_numpy().astype("datetime64[D]")
+    valid_day = ~np.isnat(day)
+    days, codes = np.unique(day[valid_day], return_inverse=True)
+    daily = {"rows": np.bincount(codes, minlength=len(days))}
+    for metric in metrics:
+        value = dat[metric].to_numpy(dtype=np.float64)[valid_day]
+        valid = ~np.isnan(value)
+        daily[f"{metric}_sum"] = np.bincount(
+            codes, weights=np.where(valid, value, 0.0), minlength=len(days)
+        )
+        daily[f"{metric}_count"] = np.bincount(codes[valid], minlength=len(days))
+    index = pd.DatetimeIndex(days.astype("datetime64[ns]"), name="day")
+    return pd.DataFrame(daily, index=index)[columns]
+
+
+def is_daily(dat: pd.DataFrame) -> bool:
+    """Is dat a daily series from daily_series"""
+    return dat.index.name == "day" and "rows" in dat.columns
+
+
+def is_cube(dat: pd.DataFrame) -> bool:
+    """Is dat a cube from build_cube rather than row level data"""
+    return "rows" in dat.columns and "Year_month" in dat.columns
+
+
+def group_mean(dat: pd.DataFrame, by, column: str) -> pd.Series:
+    """Mean of column grouped by the columns in by. dat can either be row level
+    data or a cube from build_cube, where the mean is sum / count"""
+    if not is_cube(dat):
+        return dat.groupby(by, observed=True)[column].mean()
+
+    totals = dat.groupby(by, observed=True)[[f"{column}_sum", f"{column}_count"]].sum()
+    count = totals[f"{column}_count"].replace(0, np.nan)
+    return (totals[f"{column}_sum"] / count).rename(column)
+
+
+def group_stats(cube: pd.DataFrame, by, column: str) -> pd.DataFrame:
+    """Count, mean and standard deviation (ddof=1) of column grouped by the
+    columns in by, from a cube from build_cube"""
+    totals = cube.groupby(by, observed=True)[
+        [f"{column}_sum", f"{column}_count", f"{column}_sumsq"]
+    ].sum()
+    count = totals[f"{column}_count"]
+    mean = totals[f"{column}_sum"] / count.replace(0, np.nan)
+    variance = (totals[f"{column}_sumsq"] - count * mean**2) / (count - 1).where(
+        count > 1
+    )
+    return pd.DataFrame(
+        {"count": count, "mean": mean, "std": np.sqrt(variance.clip(lower=0))}
+    )
+
+
+@traced
+def update_cube(
+    cube: pd.DataFrame, added: pd.DataFrame, removed: pd.DataFrame
+) -> pd.DataFrame:
+    """Update a cube with cleaned rows that were added to and removed from the
+    data, without rebuilding it from all rows. The sums and counts of the
+    removed rows are subtracted and cells without rows are dropped. The rows
+    need the same metrics as the cube, which keeps its grain"""
+    metrics = [c[: -len("_sum")] for c in cube.columns if c.endswith("_sum")]
+    grain = cube_grain(cube)
+    dimensions = CUBE_DIMENSIONS + [CUBE_GRAINS[grain][0]]
+    added_cube = build_cube(added, metrics, grain)
+    removed_cube = build_cube(removed, metrics, grain)
+    measures = [c for c in cube.columns if c not in dimensions + DATE_COLUMNS]
+    removed_cube[measures] = -removed_cube[measures]
+
+    # Use the same categories in all cubes so the dimensions stay categorical
+    cubes = [cube.copy(), added_cube, removed_cube]
+    for dimension in CUBE_DIMENSIONS:
+        values = [c[dimension].astype("category") for c in cubes]
+        categories = pd.api.types.union_categoricals(
+            values, ignore_order=True
+        ).categories
+        for c, value in zip(cubes, values):
+            c[dimension] = value.cat.set_categories(
+                categories, ordered=values[0].cat.ordered
+            )
+
+    cube = (
+        pd.concat([c[dimensions + measures] for c in cubes], ignore_index=True)
+        .groupby(dimensions, observed=True, dropna=False)
+        .sum()
+        .reset_index()
+    )
+    cube = cube.loc[cube["rows"] > 0].reset_index(drop=True)
+    return add_cube_dates(cube)
+
+
+def cube_key(
+    clean_key: str,
+    metrics: list = REPORT_CUBE_METRICS,
+    grain: str = REPORT_CUBE_GRAIN,
+) -> str:
+    """Key of the cube with metrics and grain of the cleaned data cached under
+    clean_key (see clean_data_key), with the distances to the hospitals in the
+    hospitals file"""
+    return cache_key(
+        table="cube",
+        clean=clean_key,
+        hospitals=hash_file(HOSPITALS_PATH),
+        metrics=metrics,
+        grain=grain,
+        code=hash_code(__file__),
+    )
+
+
+def save_cube(cube: pd.DataFrame, key: str, path: str = CUBE_PATH):
+    """Store a cube with its key (see cube_key) at path"""
+    table = pa.Table.from_pandas(cube, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"cube_key"] = key.encode()
+    table = table.replace_schema_metadata(metadata)
+    # Write to a temporary file first so a failed write leaves no broken cube
+    pq.write_table(table, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+
+
+def load_cube(key: str, path: str = CUBE_PATH):
+    """The cube stored at path, or None if there is none or it was stored with
+    another key, i.e. for other data"""
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    if metadata.get(b"cube_key") != key.encode():
+        return None
+    return pd.read_parquet(path)
+
+
+@traced
+def get_cube(
+    dat: pd.DataFrame,
+    key: str,
+    metrics: list = REPORT_CUBE_METRICS,
+    grain: str = REPORT_CUBE_GRAIN,
+    path: str = CUBE_PATH,
+) -> pd.DataFrame:
+    """The cube with metrics and grain of the cleaned data dat, read from path if it was
+    stored there for key (see cube_key), otherwise built and stored there.
+    src/update_data.py keeps the stored cube up to date when new data is
+    added, without rebuilding it"""
+    cube = load_cube(key, path)
+    if cube is None:
+        cube = build_cube(dat, metrics, grain)
+        save_cube(cube, key, path)
+    return cube
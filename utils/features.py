@@ -0,0 +1,51 @@
+""" Importing packages """
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def build_design_matrix(
+    dat: pd.DataFrame,
+    categorical: list,
+    numeric: list = [],
+    scale_numeric: bool = True,
+):
+    """Build a sparse CSR design matrix with the numeric columns followed by one
+    indicator column per category of each categorical column, in the same order
+    and with the same names as pd.get_dummies. The indicators are built from the
+    category codes and are not scaled; the numeric columns are standardized if
+    scale_numeric. Missing numeric values are replaced by the column mean and
+    missing values of a categorical column give no indicator.
+
+    Returns the matrix and the column names. Its memory grows with the number
+    of nonzero values, not with the number of categories."""
+    n_rows = len(dat)
+    rows, columns, values = [], [], []
+    column_names = []
+
+    for column in numeric:
+        value = dat[column].to_numpy(dtype=np.float64)
+        value = np.where(np.isnan(value), np.nanmean(value), value)
+        if scale_numeric:
+            std = value.std()
+            value = (value - value.mean()) / (std if std > 0 else 1.0)
+        nonzero = np.flatnonzero(value)
+        rows.append(nonzero)
+        columns.append(np.full(len(nonzero), len(column_names)))
+        values.append(value[nonzero])
+        column_names.append(column)
+
+    for column in categorical:
+        categories = dat[column].astype("category").cat
+        codes = categories.codes.to_numpy()
+        found = np.flatnonzero(codes >= 0)
+        rows.append(found)
+        columns.append(len(column_names) + codes[found].astype(np.int64))
+        values.append(np.ones(len(found)))
+        column_names += [f"{column}_{c}" for c in categories.categories]
+
+    matrix = sparse.coo_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+        shape=(n_rows, len(column_names)),
+    ).tocsr()
+    return matrix, pd.Index(column_names)
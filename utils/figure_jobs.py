@@ -0,0 +1,69 @@
+""" Importing packages """
+import os
+import sys
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+# Local
+from utils.trace import add_trace, get_trace, stage
+
+# The jobs and data of the current run. Worker processes are forked from the
+# process that set them, so they see the loaded data without copying it
+_shared = {}
+
+
+def _run_job(name: str):
+    """Build one figure, returns its name, wall time in seconds and the stages
+    it traced (see utils/trace.py)"""
+    traced_before = len(get_trace())
+    start = time.perf_counter()
+    with stage(name):
+        _shared["jobs"][name](_shared["data"])
+    return name, time.perf_counter() - start, get_trace()[traced_before:]
+
+
+def _can_fork() -> bool:
+    """Can the workers be forked safely. Only on Linux, or where fork is already
+    the start method: on macOS forking a process that has started system
+    frameworks and threads (as plotting and reading parquet do) can crash"""
+    return sys.platform.startswith("linux") or mp.get_start_method(True) == "fork"
+
+
+def run_figure_jobs(jobs: dict, data: dict, n_jobs: int = None) -> pd.Series:
+    """Run the figure jobs (name -> function taking data) across n_jobs
+    processes (all cores by default). The data is loaded once by the caller
+    and shared read-only with the workers, so the jobs must not change it.
+    Returns the wall time in seconds of each job. The figures are only saved,
+    so matplotlib draws them with the Agg backend, without a display."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    _shared["jobs"], _shared["data"] = jobs, data
+
+    times = {}
+    start = time.perf_counter()
+    # Sharing the data needs fork, otherwise the jobs run one after another
+    if n_jobs > 1 and len(jobs) > 1 and _can_fork():
+        with ProcessPoolExecutor(
+            max_workers=min(n_jobs, len(jobs)), mp_context=mp.get_context("fork")
+        ) as executor:
+            futures = [executor.submit(_run_job, name) for name in jobs]
+            for future in as_completed(futures):
+                name, seconds, trace = future.result()
+                # The stages traced in the worker are added to this process
+                add_trace(trace)
+                times[name] = seconds
+                print(f"{name}: {seconds:.1f}s")
+    else:
+        for name in jobs:
+            _, seconds, _ = _run_job(name)
+            times[name] = seconds
+            print(f"{name}: {seconds:.1f}s")
+
+    times = pd.Series(times, name="seconds")[list(jobs)]
+    print(f"Built {len(jobs)} figures in {time.perf_counter() - start:.1f}s")
+    return times
@@ -0,0 +1,370 @@
+""" Importing packages """
+import re
+import numpy as np
+import pandas as pd
+
+# Local
+from utils.trace import traced
+
+# Two numbers in parentheses, separated by spaces and/or a comma. Matches both
+# "POINT (-122.42 37.77)" and "(37.77, -122.42)"
+NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+POINT_PATTERN = re.compile(rf"\(\s*({NUMBER})\s*[,\s]\s*({NUMBER})\s*\)")
+
+
+@traced
+def parse_points(values: pd.Series, order: str = "lonlat"):
+    """Parse points such as "POINT (lon lat)" (order="lonlat") or "(lat, lon)"
+    (order="latlon") into two float arrays, returned as (latitude, longitude).
+    Both coordinates are NaN for missing values and strings without a point.
+    Each distinct string is only parsed once, in a single pass."""
+    if order not in ["lonlat", "latlon"]:
+        raise ValueError(f"Unknown order: {order}")
+
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    coordinates = pd.Series(uniques, dtype=object).str.extract(POINT_PATTERN)
+    coordinates = coordinates.astype(float).to_numpy()
+
+    # Missing values have code -1 and get NaN
+    points = np.full((len(codes), 2), np.nan)
+    found = codes >= 0
+    points[found] = coordinates[codes[found]]
+
+    if order == "lonlat":
+        return points[:, 1], points[:, 0]
+    return points[:, 0], points[:, 1]
+
+
+def _feature_rings(geometry: dict) -> list:
+    """All rings (outer and holes) of a Polygon or MultiPolygon geometry"""
+    if geometry["type"] == "Polygon":
+        return geometry["coordinates"]
+    if geometry["type"] == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+
+
+def _expand(counts: np.ndarray):
+    """Repeat each position i counts[i] times. Returns the positions and a
+    counter from 0 to counts[i] - 1 within each repeat"""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offset = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, offset
+
+
+@traced
+def build_polygon_index(
+    geojson: dict, name_property: str = "nhood", n_cells: int = 128
+) -> dict:
+    """Build a grid index over the polygons of a geojson FeatureCollection for
+    locate_points. The bounding box of the polygons is split into
+    n_cells x n_cells cells, and each cell stores the polygon edges that pass
+    through it together with which polygons contain the cell center."""
+    names = []
+    edges = []
+    for feature_id, feature in enumerate(geojson["features"]):
+        names.append(feature["properties"][name_property])
+        for ring in _feature_rings(feature["geometry"]):
+            ring = np.asarray(ring, dtype=float)[:, :2]
+            segments = np.column_stack([ring[:-1], ring[1:]])
+            # Drop zero length edges, e.g. a ring closing on itself twice
+            segments = segments[
+                (segments[:, 0] != segments[:, 2]) | (segments[:, 1] != segments[:, 3])
+            ]
+            edges.append(
+                np.column_stack([segments, np.full(len(segments), feature_id)])
+            )
+    edges = np.concatenate(edges)
+    x1, y1, x2, y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+    edge_feature = edges[:, 4].astype(np.int64)
+    n_features = len(names)
+
+    # The grid covers the bounding box of all edges
+    x_min, x_max = min(x1.min(), x2.min()), max(x1.max(), x2.max())
+    y_min, y_max = min(y1.min(), y2.min()), max(y1.max(), y2.max())
+    cell_width = (x_max - x_min) / n_cells
+    cell_height = (y_max - y_min) / n_cells
+
+    # The cells touched by the bounding box of each edge
+    def cell_range(a, b, low, size):
+        start = np.floor((np.minimum(a, b) - low) / size).astype(np.int64)
+        end = np.floor((np.maximum(a, b) - low) / size).astype(np.int64)
+        return np.clip(start, 0, n_cells - 1), np.clip(end, 0, n_cells - 1)
+
+    ix0, ix1 = cell_range(x1, x2, x_min, cell_width)
+    iy0, iy1 = cell_range(y1, y2, y_min, cell_height)
+    n_x, n_y = ix1 - ix0 + 1, iy1 - iy0 + 1
+    edge_ids, offset = _expand(n_x * n_y)
+    cell_x = ix0[edge_ids] + offset % n_x[edge_ids]
+    cell_y = iy0[edge_ids] + offset // n_x[edge_ids]
+    cells = cell_y * n_cells + cell_x
+
+    # Edges sorted by cell, cell i has cell_edges[cell_start[i]:cell_start[i + 1]]
+    order = np.argsort(cells, kind="stable")
+    cell_edges = edge_ids[order]
+    cell_start = np.searchsorted(cells[order], np.arange(n_cells * n_cells + 1))
+
+    # Which polygons contain each cell center, by casting a ray along each row
+    # of centers and counting the crossed edges of each polygon. The centers
+    # are moved by a tiny amount so they do not fall exactly on a vertex
+    center_x = x_min + (np.arange(n_cells) + 0.5 + 1e-7 * np.pi) * cell_width
+    center_y = y_min + (np.arange(n_cells) + 0.5 + 1e-7 * np.e) * cell_height
+    center_inside = np.zeros((n_cells * n_cells, n_features), dtype=bool)
+    for row, y in enumerate(center_y):
+        crossing = (y1 > y) != (y2 > y)
+        x_cross = x1[crossing] + (y - y1[crossing]) * (x2[crossing] - x1[crossing]) / (
+            y2[crossing] - y1[crossing]
+        )
+        feature_cross = edge_feature[crossing]
+        for feature_id in np.unique(feature_cross):
+            xs = np.sort(x_cross[feature_cross == feature_id])
+            inside = np.searchsorted(xs, center_x) % 2 == 1
+            center_inside[row * n_cells : (row + 1) * n_cells, feature_id] = inside
+
+    return {
+        "names": names,
+        "edges": edges[:, :4],
+        "edge_feature": edge_feature,
+        "n_cells": n_cells,
+        "origin": (x_min, y_min),
+        "cell_size": (cell_width, cell_height),
+        "centers": (center_x, center_y),
+        "cell_start": cell_start,
+        "cell_edges": cell_edges,
+        "center_inside": center_inside,
+    }
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    """Sign of the turn a -> b -> c"""
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+@traced
+def locate_points(
+    latitude: np.ndarray, longitude: np.ndarray, index: dict, batch_size=100000
+) -> np.ndarray:
+    """Find the polygon of an index from build_polygon_index that contains each
+    point. Returns the position of the polygon in index["names"], or -1 for
+    points outside all polygons or with missing coordinates.
+
+    A point is inside a polygon if its cell center is inside and the segment
+    from the point to the center crosses an even number of the polygon's
+    edges, or the other way around. That segment stays within the cell, so
+    only the edges stored for the cell have to be checked."""
+    x = np.asarray(longitude, dtype=float)
+    y = np.asarray(latitude, dtype=float)
+    result = np.full(len(x), -1, dtype=np.int64)
+
+    n_cells = index["n_cells"]
+    x_min, y_min = index["origin"]
+    cell_width, cell_height = index["cell_size"]
+    center_x, center_y = index["centers"]
+    cell_start, cell_edges = index["cell_start"], index["cell_edges"]
+    edges, edge_feature = index["edges"], index["edge_feature"]
+    n_features = len(index["names"])
+
+    cell_x = np.floor((x - x_min) / cell_width)
+    cell_y = np.floor((y - y_min) / cell_height)
+    in_grid = (cell_x >= 0) & (cell_x < n_cells) & (cell_y >= 0) & (cell_y < n_cells)
+    points = np.flatnonzero(in_grid)
+
+    for start in range(0, len(points), batch_size):
+        batch = points[start : start + batch_size]
+        px, py = x[batch], y[batch]
+        cx = cell_x[batch].astype(np.int64)
+        cy = cell_y[batch].astype(np.int64)
+        cell = cy * n_cells + cx
+        inside = index["center_inside"][cell]
+
+        # One pair for each point and edge in the point's cell
+        pair_point, offset = _expand(cell_start[cell + 1] - cell_start[cell])
+        pair_edge = cell_edges[cell_start[cell][pair_point] + offset]
+
+        # Does the segment point -> center properly cross the edge
+        ax, ay, bx, by = edges[pair_edge].T
+        qx, qy = px[pair_point], py[pair_point]
+        rx, ry = center_x[cx][pair_point], center_y[cy][pair_point]
+        crosses = (
+            _orientation(ax, ay, bx, by, qx, qy) * _orientation(ax, ay, bx, by, rx, ry)
+            < 0
+        ) & (
+            _orientation(qx, qy, rx, ry, ax, ay) * _orientation(qx, qy, rx, ry, bx, by)
+            < 0
+        )
+
+        # Flip the center's answer for every edge crossed
+        crossed = pair_point[crosses] * n_features + edge_feature[pair_edge[crosses]]
+        flips = np.bincount(crossed, minlength=len(batch) * n_features) % 2 == 1
+        inside = inside ^ flips.reshape(len(batch), n_features)
+        result[batch] = np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
+
+    return result
+
+
+def _douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Mask of the points of a line kept by Douglas-Peucker simplification. The
+    first and last point are always kept"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        a, b = points[start], points[end]
+        between = points[start + 1 : end]
+        direction = b - a
+        length = np.hypot(*direction)
+        if length == 0:
+            distance = np.hypot(*(between - a).T)
+        else:
+            # Distance to the segment from a to b
+            t = np.clip((between - a) @ direction / length**2, 0, 1)
+            distance = np.hypot(*(between - a - t[:, None] * direction).T)
+        farthest = np.argmax(distance)
+        if distance[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack += [(start, middle), (middle, end)]
+    return keep
+
+
+@traced
+def simplify_geojson(geojson: dict, tolerance: float, precision: int = 5) -> dict:
+    """Simplify the Polygon and MultiPolygon features of a geojson
+    FeatureCollection so that no border moves more than tolerance, with the
+    coordinates rounded to precision decimals.
+
+    Borders shared by two polygons stay aligned: the rings are split into arcs
+    at junctions (points with more than two distinct neighbors, where borders
+    meet) and each distinct arc is simplified once and used by every ring it
+    belongs to. Rings that would become degenerate are kept as they are."""
+    # Quantized open rings, as lists of points
+    rings = []
+    for feature in geojson["features"]:
+        for ring in _feature_rings(feature["geometry"]):
+            points = np.round(np.asarray(ring, dtype=float)[:, :2], precision)
+            points = [tuple(p) for p in points.tolist()]
+            points = [p for i, p in enumerate(points) if i == 0 or p != points[i - 1]]
+            if points[0] == points[-1]:
+                points = points[:-1]
+            rings.append(points)
+
+    neighbors = {}
+    for ring in rings:
+        for i, point in enumerate(ring):
+            neighbors.setdefault(point, set()).update(
+                [ring[i - 1], ring[(i + 1) % len(ring)]]
+            )
+    junctions = {point for point, near in neighbors.items() if len(near) > 2}
+
+    simplified_arcs = {}
+
+    def simplify_arc(arc: list) -> list:
+        # The same arc can run either way, simplify it in one direction only
+        forward = tuple(arc)
+        key = min(forward, forward[::-1])
+        if key not in simplified_arcs:
+            points = np.array(key)
+            keep = _douglas_peucker(points, tolerance)
+            simplified_arcs[key] = [p for p, k in zip(key, keep) if k]
+        result = simplified_arcs[key]
+        return result if key == forward else result[::-1]
+
+    new_rings = []
+    for ring in rings:
+        cuts = [i for i, point in enumerate(ring) if point in junctions]
+        # Start at a junction, or at the smallest point of rings without one
+        start = cuts[0] if cuts else ring.index(min(ring))
+        ring = ring[start:] + ring[:start]
+        cuts = [i for i, point in enumerate(ring) if point in junctions] or [0]
+        cuts.append(len(ring))
+
+        new_ring = [ring[0]]
+        for begin, end in zip(cuts[:-1], cuts[1:]):
+            arc = ring[begin:end] + [ring[end % len(ring)]]
+            new_ring += simplify_arc(arc)[1:]
+        if len(new_ring) < 4:
+            new_ring = ring + [ring[0]]
+        new_rings.append([list(p) for p in new_ring])
+
+    # Put the rings back into the features
+    features = []
+    rings_left = iter(new_rings)
+    for feature in geojson["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            coordinates = [next(rings_left) for _ in geometry["coordinates"]]
+        else:
+            coordinates = [
+                [next(rings_left) for _ in polygon]
+                for polygon in geometry["coordinates"]
+            ]
+        features.append(
+            {
+                **feature,
+                "geometry": {"type": geometry["type"], "coordinates": coordinates},
+            }
+        )
+    return {**geojson, "features": features}
+
+
+# Mean radius of the earth
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Points on the unit sphere, where the straight line distance between two
+    points increases with their distance along the earth"""
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    return np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Distance in km along the earth between points given in degrees"""
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+@traced
+def nearest_points(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    target_latitude: np.ndarray,
+    target_longitude: np.ndarray,
+    batch_size: int = 1000000,
+):
+    """Find the nearest target point of each point. Returns the position of the
+    nearest target (-1 for points with missing coordinates) and the distance
+    to it in km. The targets are put in a k-d tree, which the points are
+    looked up in batch_size at a time"""
+    from scipy.spatial import cKDTree
+
+    target_latitude = np.asarray(target_latitude, dtype=float)
+    target_longitude = np.asarray(target_longitude, dtype=float)
+    tree = cKDTree(_unit_vectors(target_latitude, target_longitude))
+
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    nearest = np.full(len(latitude), -1, dtype=np.int64)
+    distance = np.full(len(latitude), np.nan)
+    points = np.flatnonzero(~np.isnan(latitude) & ~np.isnan(longitude))
+    for start in range(0, len(points), batch_size):
+        batch = points[start : start + batch_size]
+        _, found = tree.query(_unit_vectors(latitude[batch], longitude[batch]))
+        nearest[batch] = found
+        distance[batch] = haversine(
+            latitude[batch],
+            longitude[batch],
+            target_latitude[found],
+            target_longitude[found],
+        )
+    return nearest, distance
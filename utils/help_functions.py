@@ -1,9 +1,11 @@
-from bokeh.palettes import Viridis256
 import numpy as np
 
 
 def get_viridis_pallette(n: int):
     """Creates a viridis pallette with n colors"""
+    # Imported here so that importing this module does not load bokeh
+    from bokeh.palettes import Viridis256
+
     idx = np.round(np.linspace(0, len(Viridis256) - 1, n, dtype="int"))
     viridis = [Viridis256[i] for i in idx]
     return viridis
@@ -17,3 +19,36 @@ def format_string(s):
     s = s.title()
 
     return s
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest triangle three buckets downsampling of the line (x, y) to n_out
+    points. Returns the positions of the points to keep, which always include
+    the first and last point and follow the shape of the line"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # The points between the first and last are split into n_out - 2 buckets
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    keep = np.zeros(n_out, dtype=np.int64)
+    keep[-1] = n - 1
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket, or the last point after the last bucket
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Keep the point making the largest triangle with the last kept point
+        # and the average of the next bucket
+        prev_x, prev_y = x[keep[i]], y[keep[i]]
+        area = np.abs(
+            (prev_x - next_x) * (y[start:end] - prev_y)
+            - (prev_x - x[start:end]) * (next_y - prev_y)
+        )
+        keep[i + 1] = start + np.argmax(area)
+    return keep
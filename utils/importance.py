@@ -0,0 +1,117 @@
+""" Importing packages """
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from scipy import sparse
+
+# Design matrix and target opened by each worker process, see _open_data
+_data = {}
+# Parameters of the random forests, unless others are given
+FOREST_PARAMS = {"n_estimators": 100, "max_depth": 5}
+
+
+def _save_data(X, y, folder: str) -> dict:
+    """Save the design matrix (dense or sparse CSR) and target as .npy files in
+    folder, returns their paths for _open_data"""
+    arrays = {"y": np.asarray(y)}
+    if sparse.issparse(X):
+        X = sparse.csr_matrix(X)
+        arrays.update(data=X.data, indices=X.indices, indptr=X.indptr)
+        arrays["shape"] = np.array(X.shape)
+    else:
+        arrays["X"] = np.ascontiguousarray(X)
+
+    paths = {}
+    for name, array in arrays.items():
+        paths[name] = os.path.join(folder, f"{name}.npy")
+        np.save(paths[name], array)
+    return paths
+
+
+def _open_data(paths: dict):
+    """Open the memory mapped design matrix and target in a worker process"""
+    arrays = {name: np.load(path, mmap_mode="r") for name, path in paths.items()}
+    _data["y"] = arrays["y"]
+    if "X" in arrays:
+        _data["X"] = arrays["X"]
+    else:
+        _data["X"] = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(arrays["shape"]),
+            copy=False,
+        )
+
+
+def fit_forest(X, y, seed, sample_size: int, model_params: dict = None):
+    """Fit a random forest on a random sample of sample_size rows of X and y, as
+    each iteration of bootstrap_importances does with its seed"""
+    from sklearn.ensemble import RandomForestRegressor
+
+    if model_params is None:
+        model_params = FOREST_PARAMS
+    rng = np.random.default_rng(seed)
+    # Sorted rows are read from the memory mapped file in order
+    n_rows = X.shape[0]
+    sample = np.sort(rng.choice(n_rows, min(sample_size, n_rows), replace=False))
+    model = RandomForestRegressor(
+        random_state=int(rng.integers(2**31)), n_jobs=1, **model_params
+    )
+    model.fit(X[sample], y[sample])
+    return model
+
+
+def bootstrap_seeds(seed: int, n_iterations: int) -> list:
+    """Seeds of the iterations of bootstrap_importances"""
+    return np.random.SeedSequence(seed).spawn(n_iterations)
+
+
+def _fit_sample(iteration: int, seed, sample_size: int, model_params: dict):
+    """Fit a random forest on a sample of the rows and return its importances"""
+    model = fit_forest(_data["X"], _data["y"], seed, sample_size, model_params)
+    return iteration, model.feature_importances_
+
+
+def bootstrap_importances(
+    X: np.ndarray,
+    y: np.ndarray,
+    n_iterations: int = 10,
+    sample_size: int = 100000,
+    seed: int = 123,
+    n_jobs: int = None,
+    model_params: dict = None,
+) -> np.ndarray:
+    """Fit n_iterations random forests on random samples of sample_size rows and
+    return their feature importances as an array of features x iterations.
+    X can be a dense array or a sparse matrix.
+
+    The design matrix is written once to memory mapped files that the n_jobs
+    worker processes (all cores by default) read from, so it is not copied to
+    each of them. Each iteration gets its own seed from seed, so the result
+    does not depend on the number of processes."""
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if model_params is None:
+        model_params = FOREST_PARAMS
+    seeds = bootstrap_seeds(seed, n_iterations)
+    importances = np.zeros((X.shape[1], n_iterations))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = _save_data(X, y, tmp)
+
+        with ProcessPoolExecutor(
+            max_workers=min(n_jobs, n_iterations),
+            initializer=_open_data,
+            initargs=(paths,),
+        ) as executor:
+            futures = [
+                executor.submit(_fit_sample, i, seeds[i], sample_size, model_params)
+                for i in range(n_iterations)
+            ]
+            # Collect the importances as the iterations finish
+            for done, future in enumerate(as_completed(futures), start=1):
+                iteration, importance = future.result()
+                importances[:, iteration] = importance
+                print(f"Bootstrap iteration {done}/{n_iterations} done")
+
+    return importances
@@ -0,0 +1,165 @@
+""" Importing packages """
+import numpy as np
+import pandas as pd
+
+# Local
+from utils import geo, make_data, time_index
+from utils.cache import (
+    cache_key,
+    cached_frame,
+    hash_code,
+    hash_file,
+    load_cached,
+    save_cached,
+)
+from utils.make_data import (
+    clean_data,
+    concat_frames,
+    fill_neighborhoods,
+    get_data,
+    _data_path,
+)
+from utils.trace import traced
+
+# Columns that are the same for all units of an incident, taken from its first
+# unit
+INCIDENT_COLUMNS = [
+    "incident_number",
+    "call_number",
+    "call_type",
+    "call_date",
+    "received_dttm",
+    "neighborhood",
+    "period_of_day",
+    "latitude",
+    "longitude",
+]
+# Stands in for missing timestamps so they sort after all others
+LAST = np.iinfo(np.int64).max
+
+
+def _nanoseconds(times: pd.Series) -> np.ndarray:
+    """int64 nanoseconds of a datetime column, LAST where missing"""
+    times = times.to_numpy(dtype="datetime64[ns]")
+    return np.where(np.isnat(times), LAST, times.view(np.int64))
+
+
+def _times(nanoseconds: np.ndarray) -> np.ndarray:
+    """datetime64 of nanoseconds from _nanoseconds, missing where LAST"""
+    times = nanoseconds.view("datetime64[ns]").copy()
+    times[nanoseconds == LAST] = np.datetime64("NaT")
+    return times
+
+
+@traced
+def build_incidents(dat: pd.DataFrame) -> pd.DataFrame:
+    """Incident table of the data from clean_data, which has a row per
+    dispatched unit. Has one row per incident with the INCIDENT_COLUMNS, the
+    number of units and of units kept by clean_data, the response time of the
+    first unit on scene, the first transport (its time, transport time and the
+    number of transports) and the highest number of alarms. If dat is from
+    clean_data with drop=False, every incident is in the table and the times
+    are only taken from the units clean_data keeps, so they are missing for
+    incidents it drops entirely (kept_units 0). The units are sorted by
+    incident once, and each column is reduced over the runs of units of an
+    incident."""
+    if "drop_reasons" in dat.columns:
+        kept = dat["drop_reasons"].to_numpy() == 0
+    else:
+        kept = np.ones(len(dat), dtype=bool)
+    # Within an incident the kept units come first, sorted by transport, so
+    # the first unit of each incident is the first kept one transported
+    transport = np.where(kept, _nanoseconds(dat["transport_dttm"]), LAST)
+    order = np.lexsort((transport, ~kept, dat["incident_number"].to_numpy()))
+    incident = dat["incident_number"].to_numpy()[order]
+    # Position of the first unit of each incident
+    new_incident = np.ones(len(incident), dtype=bool)
+    new_incident[1:] = incident[1:] != incident[:-1]
+    starts = np.flatnonzero(new_incident)
+    first = order[starts]
+
+    incidents = dat[INCIDENT_COLUMNS].iloc[first].reset_index(drop=True)
+    incidents["units"] = np.diff(np.r_[starts, len(order)]).astype(np.int16)
+    kept_units = np.add.reduceat(kept[order].astype(np.int16), starts)
+    incidents["kept_units"] = kept_units.astype(np.int16)
+    # All units share the received time, so the shortest response time is
+    # that of the first unit on scene
+    response_time = np.where(kept, dat["response_time"].to_numpy(np.float32), np.nan)
+    incidents["response_time"] = np.fmin.reduceat(response_time[order], starts)
+    on_scene = np.where(kept, _nanoseconds(dat["on_scene_dttm"]), LAST)[order]
+    incidents["first_on_scene_dttm"] = _times(np.minimum.reduceat(on_scene, starts))
+    incidents["first_transport_dttm"] = _times(transport[first])
+    transport_time = dat["transport_time"].to_numpy(dtype=np.float32)[first]
+    incidents["transport_time"] = np.where(kept[first], transport_time, np.nan)
+    transported = (transport[order] != LAST).astype(np.int16)
+    incidents["transports"] = np.add.reduceat(transported, starts).astype(np.int16)
+    incidents["number_of_alarms"] = np.maximum.reduceat(
+        dat["number_of_alarms"].to_numpy()[order], starts
+    )
+    return incidents
+
+
+def get_incidents(
+    neighborhoods: dict = None, file_format: str = None, use_cache: bool = True
+) -> pd.DataFrame:
+    """Incident table (see build_incidents) of all incidents in the data from
+    get_data, including those clean_data drops, with missing neighborhoods
+    filled in by fill_neighborhoods if neighborhoods is given. It is cached
+    on disk next to the cleaned data and keyed on the data file,
+    neighborhoods and code, so incident level analyses read the small table
+    instead of scanning every unit"""
+
+    def build():
+        return _build_from_units(get_data(file_format), neighborhoods)
+
+    if not use_cache:
+        return build()
+    return cached_frame(incidents_key(neighborhoods, file_format), build)
+
+
+def _build_from_units(dat: pd.DataFrame, neighborhoods: dict = None):
+    """Incident table of units from get_data, see get_incidents"""
+    dat = clean_data(dat, drop=False)
+    if neighborhoods is not None:
+        dat = fill_neighborhoods(dat, neighborhoods)
+    return build_incidents(dat)
+
+
+def incidents_key(neighborhoods: dict = None, file_format: str = None) -> str:
+    """Key of the table from get_incidents in the cache, for the data file as it
+    is now"""
+    _, path = _data_path(file_format)
+    return cache_key(
+        table="incidents",
+        data=hash_file(path),
+        neighborhoods=neighborhoods,
+        code=hash_code(make_data.__file__, geo.__file__, time_index.__file__, __file__),
+    )
+
+
+@traced
+def update_incidents(
+    key: str, added: pd.DataFrame, replaced: pd.DataFrame, neighborhoods: dict = None
+):
+    """Update the table from get_incidents cached under key, the incidents_key
+    from before update_data, with the rows update_data added and replaced.
+    Only the incidents of those rows are built again, from all their units in
+    the updated data file, and the result is cached under the key of the
+    updated data file. Returns the table, or None if there is nothing under
+    key"""
+    incidents = load_cached(key)
+    if incidents is None:
+        return None
+
+    numbers = pd.concat([added["Incident Number"], replaced["Incident Number"]])
+    numbers = numbers.unique().tolist()
+    _, path = _data_path("parquet")
+    units = pd.read_parquet(path, filters=[("Incident Number", "in", numbers)])
+    rebuilt = _build_from_units(units, neighborhoods)
+    kept = ~incidents["incident_number"].isin(numbers).to_numpy()
+    incidents = concat_frames([incidents.loc[kept], rebuilt])
+    # In incident order, as from build_incidents
+    order = np.argsort(incidents["incident_number"].to_numpy(), kind="stable")
+    incidents = incidents.iloc[order].reset_index(drop=True)
+    save_cached(incidents_key(neighborhoods), incidents)
+    return incidents
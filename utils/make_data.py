@@ -1,76 +1,303 @@
 """ Importing packages """
 import datetime as dt
+import itertools
+import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import json
 
-
-def create_data():
-    """Read in the raw data and clean it. Write out a clean csv file"""
-    raw_dat = pd.read_csv("data/fireIncidents.csv")
-    # Create a copy of the data to clean
-    dat = raw_dat.copy()
-
-    """ Clean data """
+# Local
+from utils.const import (
+    RAW_DATA_PATH,
+    CLEAN_DATA_CSV_PATH,
+    CLEAN_DATA_PARQUET_PATH,
+    WATERMARK_PATH,
+    NEIGHBORHOODS_PATH,
+    HOSPITALS_PATH,
+)
+from utils.cache import (
+    cache_key,
+    cached_frame,
+    cached_json,
+    hash_code,
+    hash_file,
+    load_cached,
+    save_cached,
+)
+from utils import geo, time_index
+from utils.geo import (
+    parse_points,
+    build_polygon_index,
+    locate_points,
+    simplify_geojson,
+    nearest_points,
+)
+from utils.parse_dates import parse_date_columns
+from utils.time_index import is_time_sorted, sort_positions, year_slice
+from utils.trace import stage, traced
+
+# Formats of the date columns in the raw data
+DATE_FORMATS = {
+    "Call Date": "%m/%d/%Y",
+    "Watch Date": "%m/%d/%Y",
+    "Received DtTm": "%m/%d/%Y %I:%M:%S %p",
+    "Entry DtTm": "%m/%d/%Y %H:%M:%S %p",
+    "Dispatch DtTm": "%m/%d/%Y %I:%M:%S %p",
+    "Response DtTm": "%m/%d/%Y %I:%M:%S %p",
+    "On Scene DtTm": "%m/%d/%Y %I:%M:%S %p",
+    "Transport DtTm": "%m/%d/%Y %I:%M:%S %p",
+    "Hospital DtTm": "%m/%d/%Y %I:%M:%S %p",
+    "Available DtTm": "%m/%d/%Y %I:%M:%S %p",
+}
+
+# Types of the rest of the columns in the raw data. Columns with few distinct
+# values are read as categories, the other text columns as strings. The
+# integer and bool columns are nullable so blank cells do not stop the read,
+# apply_schema narrows them after cleaning.
+RAW_DTYPES = {
+    "Call Number": "Int64",
+    "Unit ID": "string",
+    "Incident Number": "Int64",
+    "Call Type": "category",
+    "Call Final Disposition": "category",
+    "Address": "string",
+    "City": "category",
+    "Zipcode of Incident": "float64",
+    "Battalion": "category",
+    "Station Area": "category",
+    "Box": "category",
+    "Original Priority": "category",
+    "Priority": "category",
+    "Final Priority": "category",
+    "ALS Unit": "boolean",
+    "Call Type Group": "category",
+    "Number of Alarms": "Int64",
+    "Unit Type": "category",
+    "Unit sequence in call dispatch": "Int64",
+    "Fire Prevention District": "category",
+    "Supervisor District": "float64",
+    "Neighborhooods - Analysis Boundaries": "category",
+    "RowID": "string",
+    "case_location": "string",
+    "Analysis Neighborhoods": "float64",
+}
+
+
+@traced
+def prepare_raw_data(
+    dat: pd.DataFrame, n_jobs: int = None, year_to: int = 2023
+) -> pd.DataFrame:
+    """Only keep the raw data from 2012 to year_to (all years after 2012 if
+    year_to is None) and convert the date columns. n_jobs is the number of
+    processes used to parse the dates"""
     # Convert Call Date to datetime
-    dat["Call Date"] = pd.to_datetime(dat["Call Date"], format="%m/%d/%Y")
+    parse_date_columns(dat, {"Call Date": DATE_FORMATS["Call Date"]}, n_jobs=1)
 
-    # Only keep data from 2012 to 2023
-    dat = dat.loc[dat["Call Date"] < dt.datetime(2023, 1, 1)]
-    dat = dat.loc[dat["Call Date"] >= dt.datetime(2012, 1, 1)]
+    # Only keep data from 2012 to year_to
+    with stage("filter years", len(dat)) as s:
+        keep = dat["Call Date"] >= dt.datetime(2012, 1, 1)
+        if year_to is not None:
+            keep &= dat["Call Date"] < dt.datetime(year_to, 1, 1)
+        dat = dat.loc[keep].copy()
+        s.rows_out = len(dat)
 
     # Convert the rest of the date columns to datetime
-    dat["Watch Date"] = pd.to_datetime(dat["Watch Date"], format="%m/%d/%Y")
-    dat["Received DtTm"] = pd.to_datetime(
-        dat["Received DtTm"], format="%m/%d/%Y %I:%M:%S %p"
-    )
-    dat["Entry DtTm"] = pd.to_datetime(dat["Entry DtTm"], format="%m/%d/%Y %H:%M:%S %p")
-    dat["Dispatch DtTm"] = pd.to_datetime(
-        dat["Dispatch DtTm"], format="%m/%d/%Y %I:%M:%S %p"
-    )
-    dat["Response DtTm"] = pd.to_datetime(
-        dat["Response DtTm"], format="%m/%d/%Y %I:%M:%S %p"
-    )
-    dat["On Scene DtTm"] = pd.to_datetime(
-        dat["On Scene DtTm"], format="%m/%d/%Y %I:%M:%S %p"
-    )
-    dat["Transport DtTm"] = pd.to_datetime(
-        dat["Transport DtTm"], format="%m/%d/%Y %I:%M:%S %p"
-    )
-    dat["Hospital DtTm"] = pd.to_datetime(
-        dat["Hospital DtTm"], format="%m/%d/%Y %I:%M:%S %p"
-    )
-    dat["Available DtTm"] = pd.to_datetime(
-        dat["Available DtTm"], format="%m/%d/%Y %I:%M:%S %p"
+    parse_date_columns(
+        dat, {c: f for c, f in DATE_FORMATS.items() if c != "Call Date"}, n_jobs
     )
 
-    # write out a csv file called "fireIncidents_clean.csv"
-    dat.to_csv("data/fireIncidents_clean.csv", index=False)
-
-
-def get_data():
-    """Read in the cleaned data"""
-    parse_dates = [
-        "Call Date",
-        "Watch Date",
-        "Received DtTm",
-        "Entry DtTm",
-        "Dispatch DtTm",
-        "Response DtTm",
-        "On Scene DtTm",
-        "Transport DtTm",
-        "Hospital DtTm",
-        "Available DtTm",
-    ]
-    dat = pd.read_csv(
-        "data/fireIncidents_clean.csv", parse_dates=parse_dates, low_memory=False
-    )
     return dat
 
 
-def get_neighborhoods():
-    """Read in the neighborhoods data"""
-    f = open("data/neighborhoods.geojson", "r")
-    neighborhoods = json.load(f)
+@traced
+def create_data(file_format: str = "parquet", chunksize: int = None, n_jobs=None):
+    """Read in the raw data and clean it. Write out a clean parquet or csv file.
+    If chunksize is given the raw data is read and written chunksize rows at a
+    time so the memory use does not grow with the size of the raw file. n_jobs
+    is the number of processes used to parse the dates."""
+    if file_format not in ["parquet", "csv"]:
+        raise ValueError(f"Unknown file format: {file_format}")
+
+    if chunksize is None:
+        with stage("read_csv") as s:
+            dat = pd.read_csv(RAW_DATA_PATH, dtype=RAW_DTYPES)
+            s.rows_out = len(dat)
+        dat = prepare_raw_data(dat, n_jobs)
+        with stage(f"write {file_format}", len(dat)):
+            if file_format == "parquet":
+                # The parquet file keeps the datetime, category and numeric types
+                dat.to_parquet(CLEAN_DATA_PARQUET_PATH, index=False, compression="zstd")
+            else:
+                dat.to_csv(CLEAN_DATA_CSV_PATH, index=False)
+        _write_watermark(dat["Received DtTm"].max())
+        return
+
+    chunks = pd.read_csv(RAW_DATA_PATH, dtype=RAW_DTYPES, chunksize=chunksize)
+    writer = None
+    received = []
+    for i in itertools.count():
+        with stage("read_csv") as s:
+            chunk = next(chunks, None)
+            s.rows_out = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+        dat = prepare_raw_data(chunk, n_jobs)
+        received.append(dat["Received DtTm"].max())
+        if file_format == "csv":
+            # Append to the csv file, only writing the header with the first chunk
+            with stage("write csv", len(dat)):
+                dat.to_csv(
+                    CLEAN_DATA_CSV_PATH,
+                    index=False,
+                    mode="w" if i == 0 else "a",
+                    header=i == 0,
+                )
+            continue
+
+        with stage("write parquet", len(dat)):
+            table = pa.Table.from_pandas(dat, preserve_index=False)
+            if writer is None:
+                schema = _chunk_schema(table.schema)
+                writer = pq.ParquetWriter(
+                    CLEAN_DATA_PARQUET_PATH, schema, compression="zstd"
+                )
+            # Each chunk is written as its own row group
+            writer.write_table(table.cast(schema))
+
+    if writer is not None:
+        writer.close()
+    _write_watermark(pd.Series(received, dtype="datetime64[ns]").max())
+
+
+def get_watermark() -> pd.Timestamp:
+    """The latest Received DtTm in the cleaned data"""
+    if os.path.exists(WATERMARK_PATH):
+        with open(WATERMARK_PATH, "r") as f:
+            return pd.Timestamp(json.load(f)["received_dttm"])
+
+    # Older clean files have no watermark, read it from the data
+    dat = pd.read_parquet(CLEAN_DATA_PARQUET_PATH, columns=["Received DtTm"])
+    return dat["Received DtTm"].max()
+
+
+def _write_watermark(received: pd.Timestamp):
+    """Store the latest Received DtTm of the cleaned data"""
+    with open(WATERMARK_PATH, "w") as f:
+        json.dump({"received_dttm": pd.Timestamp(received).isoformat()}, f)
+
+
+def update_data(raw_path: str, chunksize: int = 500000, n_jobs: int = None):
+    """Add the rows of a new raw export, e.g. the latest month, to the clean
+    parquet file without processing the rows that are already in it. Only
+    rows received at or after the watermark (see get_watermark) get their
+    dates parsed and are added. New rows with a RowID that is already in the
+    clean data replace the old rows. The clean file is rewritten batch by
+    batch without parsing it. Returns the added rows and the rows they
+    replaced, as from get_data, so derived data such as the cube can be
+    updated instead of rebuilt."""
+    watermark = get_watermark()
+
+    "Read the new rows"
+    new_rows = []
+    for chunk in pd.read_csv(raw_path, dtype=RAW_DTYPES, chunksize=chunksize):
+        # Only parse the rest of the dates for rows after the watermark
+        parse_date_columns(
+            chunk, {"Received DtTm": DATE_FORMATS["Received DtTm"]}, n_jobs=1
+        )
+        chunk = chunk.loc[chunk["Received DtTm"] >= watermark]
+        if len(chunk) > 0:
+            new_rows.append(prepare_raw_data(chunk, n_jobs, year_to=None))
+
+    store = pq.ParquetFile(CLEAN_DATA_PARQUET_PATH)
+    schema = _chunk_schema(store.schema_arrow)
+    if len(new_rows) == 0:
+        empty = schema.empty_table().to_pandas()
+        return empty, empty
+    added = pd.concat(new_rows, ignore_index=True)
+    # Keep the last version of rows that are in the new export more than once
+    added = added.drop_duplicates(subset="RowID", keep="last", ignore_index=True)
+    added_table = pa.Table.from_pandas(added, preserve_index=False).cast(schema)
+
+    "Upsert by RowID"
+    new_row_ids = added_table["RowID"].combine_chunks()
+    replaced = []
+    tmp_path = CLEAN_DATA_PARQUET_PATH + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+        for batch in store.iter_batches(batch_size=chunksize):
+            table = pa.Table.from_batches([batch]).cast(schema)
+            is_new = pc.is_in(table["RowID"], value_set=new_row_ids)
+            replaced.append(table.filter(is_new))
+            writer.write_table(table.filter(pc.invert(is_new)))
+        writer.write_table(added_table)
+    store.close()
+    os.replace(tmp_path, CLEAN_DATA_PARQUET_PATH)
+
+    _write_watermark(pd.Series([watermark, added["Received DtTm"].max()]).max())
+    replaced = pa.concat_tables(replaced) if replaced else schema.empty_table()
+    return added_table.to_pandas(), replaced.to_pandas()
+
+
+def _chunk_schema(schema: pa.Schema) -> pa.Schema:
+    """The schema all chunks are cast to before they are written. The categories
+    of a chunk only hold the values seen in that chunk, so the dictionary
+    columns get the same index and value types in every chunk. Columns that
+    are empty in the first chunk are written as strings"""
+    fields = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def _data_path(file_format: str = None):
+    """Format and path of the data read by get_data"""
+    if file_format is None:
+        file_format = "parquet" if os.path.exists(CLEAN_DATA_PARQUET_PATH) else "csv"
+    if file_format == "parquet":
+        return file_format, CLEAN_DATA_PARQUET_PATH
+    if file_format == "csv":
+        return file_format, CLEAN_DATA_CSV_PATH
+    raise ValueError(f"Unknown file format: {file_format}")
+
+
+@traced
+def get_data(file_format: str = None):
+    """Read in the cleaned data. Uses the parquet file if it exists unless
+    file_format is given"""
+    file_format, path = _data_path(file_format)
+    if file_format == "parquet":
+        return pd.read_parquet(path)
+
+    dat = pd.read_csv(path, parse_dates=list(DATE_FORMATS), low_memory=False)
+    return dat
+
+
+@traced
+def get_neighborhoods(tolerance: float = None, precision: int = 5):
+    """Read in the neighborhoods data. If tolerance (in degrees) is given, the
+    polygons are simplified by up to tolerance with shared borders kept
+    aligned and the coordinates rounded to precision decimals, which makes
+    maps much smaller. The simplified polygons are cached on disk"""
+    with open(NEIGHBORHOODS_PATH, "r") as f:
+        neighborhoods = json.load(f)
+
+    if tolerance is not None:
+        key = cache_key(
+            data=hash_file(NEIGHBORHOODS_PATH),
+            tolerance=tolerance,
+            precision=precision,
+            code=hash_code(geo.__file__),
+        )
+        neighborhoods = cached_json(
+            key, lambda: simplify_geojson(neighborhoods, tolerance, precision)
+        )
+
     # Add an id to each neighborhood
     for f in neighborhoods["features"]:
         f["id"] = f["properties"]["nhood"]
@@ -78,18 +305,52 @@ def get_neighborhoods():
     return neighborhoods
 
 
+@traced
+def fill_neighborhoods(dat: pd.DataFrame, neighborhoods: dict) -> pd.DataFrame:
+    """Find the neighborhood of each row of the cleaned data from its latitude and
+    longitude, using the polygons from get_neighborhoods. Missing neighborhoods
+    are filled in, in place. The number of rows filled, rows whose neighborhood
+    does not match their location and rows that could not be located are
+    stored in dat.attrs["neighborhood_check"]"""
+    index = build_polygon_index(neighborhoods)
+    located = locate_points(dat["latitude"], dat["longitude"], index)
+
+    # Compare the category codes of the given and located neighborhoods
+    neighborhood = dat["neighborhood"].astype("category")
+    new_names = [n for n in index["names"] if n not in neighborhood.cat.categories]
+    neighborhood = neighborhood.cat.add_categories(new_names)
+    name_codes = neighborhood.cat.categories.get_indexer(index["names"])
+    located_codes = np.where(located >= 0, name_codes[located], -1)
+    codes = neighborhood.cat.codes.to_numpy()
+
+    missing = codes == -1
+    found = located_codes >= 0
+    codes = np.where(missing, located_codes, codes)
+    dat["neighborhood"] = pd.Categorical.from_codes(
+        codes, categories=neighborhood.cat.categories
+    )
+    dat.attrs["neighborhood_check"] = {
+        "filled": int(np.count_nonzero(missing & found)),
+        "mismatched": int(
+            np.count_nonzero(~missing & found & (codes != located_codes))
+        ),
+        "not_located": int(np.count_nonzero(~found)),
+    }
+    return dat
+
+
+@traced
 def get_hospitals():
     """Read in the hospitals location data and clean it"""
-    hospitals = pd.read_csv("data/hospitals.csv")
+    with stage("read_csv") as s:
+        hospitals = pd.read_csv(HOSPITALS_PATH)
+        s.rows_out = len(hospitals)
 
     "Clean up the location column"
-    # extract the latitude and longitude from the case_location column and add them as seperate columns
-    location = hospitals["Location"].str.extract(r"\((.+)\)")
-    hospitals["latitude"] = location[0].str.split(", ").str[0]
-    hospitals["longitude"] = location[0].str.split(", ").str[1]
-    # convert the latitude and longitude columns to numeric
-    hospitals["latitude"] = pd.to_numeric(hospitals["latitude"])
-    hospitals["longitude"] = pd.to_numeric(hospitals["longitude"])
+    # Location ends with "(lat, lon)", add the latitude and longitude as seperate columns
+    latitude, longitude = parse_points(hospitals["Location"], "latlon")
+    hospitals["latitude"] = latitude
+    hospitals["longitude"] = longitude
 
     # Filter to only include hospitals
     hospitals = hospitals.loc[hospitals["Services"] == "Hospital"]
@@ -112,10 +373,165 @@ def get_hospitals():
     return hospitals
 
 
-def clean_data(dat: pd.DataFrame) -> pd.DataFrame:
+@traced
+def add_nearest_hospital(dat: pd.DataFrame, hospitals: dict) -> pd.DataFrame:
+    """Add the name of the nearest hospital from get_hospitals to each row of
+    the cleaned data (nearest_hospital) and the distance to it in km
+    (hospital_distance), missing for rows without a location"""
+    latitude = np.asarray(hospitals["latitude"], dtype=float)
+    longitude = np.asarray(hospitals["longitude"], dtype=float)
+    located = ~np.isnan(latitude) & ~np.isnan(longitude)
+    names = np.asarray(hospitals["name"], dtype=object)[located]
+
+    nearest, distance = nearest_points(
+        dat["latitude"], dat["longitude"], latitude[located], longitude[located]
+    )
+    name_codes, unique_names = pd.factorize(names)
+    codes = np.where(nearest >= 0, name_codes[nearest], -1)
+    dat["nearest_hospital"] = pd.Categorical.from_codes(codes, unique_names)
+    dat["hospital_distance"] = distance.astype(np.float32)
+    return dat
+
+
+# Reasons for clean_data to drop a row, each reason is one bit of the drop mask
+DROP_REASONS = {
+    "cancelled": 1,
+    "duplicate": 2,
+    "no_on_scene_time": 4,
+    "response_time_below_0": 8,
+    "response_time_above_720": 16,
+    "transport_time_below_0": 32,
+    "transport_time_above_720": 64,
+    "no_received_time": 128,
+}
+
+
+@traced
+def get_drop_reasons(dat: pd.DataFrame, intervals: dict = None) -> np.ndarray:
+    """Compute a bitmask (see DROP_REASONS) of the reasons each row of the data
+    from get_data is dropped by clean_data. Rows with mask 0 are kept. The
+    response and transport times are taken from intervals (from
+    get_interval_metrics) if given."""
+    disposition = dat["Call Final Disposition"]
+    if intervals is None:
+        intervals, _ = get_interval_metrics(dat)
+    response_time = intervals["response_time"]
+    transport_time = intervals["transport_time"]
+
+    # Rows without a received or on scene time have no response time and are
+    # dropped, missing transport times are kept
+    masks = {
+        "cancelled": lambda: (disposition == "Cancelled").to_numpy(),
+        "duplicate": lambda: (disposition == "Duplicate").to_numpy(),
+        "no_on_scene_time": lambda: dat["On Scene DtTm"].isna().to_numpy(),
+        "response_time_below_0": lambda: response_time < 0,
+        "response_time_above_720": lambda: response_time > 720,
+        "transport_time_below_0": lambda: transport_time < 0,
+        "transport_time_above_720": lambda: transport_time > 720,
+        "no_received_time": lambda: dat["Received DtTm"].isna().to_numpy(),
+    }
+    reasons = np.zeros(len(dat), dtype=np.uint8)
+    for reason, find_rows in masks.items():
+        # The rows out of each filter are the rows it would keep on its own
+        with stage(f"drop {reason}", len(dat)) as s:
+            mask = find_rows()
+            reasons[mask] |= DROP_REASONS[reason]
+            s.rows_out = len(dat) - int(np.count_nonzero(mask))
+
+    return reasons
+
+
+def count_drop_reasons(reasons: np.ndarray) -> dict:
+    """Count the rows flagged with each reason in a mask from get_drop_reasons.
+    A row can have more than one reason, "total" is the number of dropped rows"""
+    counts = {
+        reason: int(np.count_nonzero(reasons & bit))
+        for reason, bit in DROP_REASONS.items()
+    }
+    counts["total"] = int(np.count_nonzero(reasons))
+    return counts
+
+
+# Intervals between the timestamps of a unit, in minutes from the first to
+# the second column of the data from get_data. The travel time is from dispatch,
+# so intake, queue and travel time add up to the response time.
+INTERVAL_METRICS = {
+    "response_time": ("Received DtTm", "On Scene DtTm"),
+    "transport_time": ("Transport DtTm", "Hospital DtTm"),
+    "intake_time": ("Received DtTm", "Entry DtTm"),
+    "queue_time": ("Entry DtTm", "Dispatch DtTm"),
+    "travel_time": ("Dispatch DtTm", "On Scene DtTm"),
+    "turnout_time": ("Dispatch DtTm", "Response DtTm"),
+    "hospital_time": ("Hospital DtTm", "Available DtTm"),
+    "busy_time": ("Dispatch DtTm", "Available DtTm"),
+}
+# Bit of each interval in the valid_intervals column of the cleaned data
+INTERVAL_BITS = {metric: 1 << i for i, metric in enumerate(INTERVAL_METRICS)}
+NANOSECONDS_PER_MINUTE = 60 * 1000000000
+
+
+@traced
+def get_interval_metrics(dat: pd.DataFrame):
+    """Compute the intervals in INTERVAL_METRICS for each row of the data from
+    get_data, from the int64 nanoseconds of the timestamps. Each timestamp
+    column is read once. Returns a dict of float32 minutes, missing where one
+    of the timestamps is, and a bitmask (see INTERVAL_BITS) of the intervals
+    that are valid: both timestamps present and the second not before the
+    first."""
+    columns = {c for pair in INTERVAL_METRICS.values() for c in pair}
+    times = {c: dat[c].to_numpy(dtype="datetime64[ns]") for c in columns}
+    nanoseconds = {c: t.view(np.int64) for c, t in times.items()}
+    missing = {c: np.isnat(t) for c, t in times.items()}
+
+    intervals = {}
+    valid = np.zeros(len(dat), dtype=np.uint8)
+    for metric, (start, end) in INTERVAL_METRICS.items():
+        with stage(metric, len(dat)) as s:
+            difference = nanoseconds[end] - nanoseconds[start]
+            absent = missing[start] | missing[end]
+            minutes = (difference / NANOSECONDS_PER_MINUTE).astype(np.float32)
+            minutes[absent] = np.nan
+            intervals[metric] = minutes
+            is_valid = ~absent & (difference >= 0)
+            valid[is_valid] |= INTERVAL_BITS[metric]
+            s.rows_out = int(np.count_nonzero(is_valid))
+    return intervals, valid
+
+
+def interval_valid(dat: pd.DataFrame, metrics) -> np.ndarray:
+    """Rows of the cleaned data where all of metrics (one name or a list of
+    names from INTERVAL_METRICS) are valid, from the valid_intervals column"""
+    if isinstance(metrics, str):
+        metrics = [metrics]
+    bits = sum(INTERVAL_BITS[metric] for metric in metrics)
+    return (dat["valid_intervals"].to_numpy() & bits) == bits
+
+
+@traced
+def clean_data(
+    dat: pd.DataFrame, report_schema: bool = False, drop: bool = True
+) -> pd.DataFrame:
+    """Clean the data from get_data. All rows to drop are found first so the
+    cleaned data is only copied once. The number of rows dropped for each
+    reason is stored in dat_clean.attrs["drop_counts"]. If drop is False no
+    rows are dropped, and the reasons each row would be dropped for are kept
+    in the drop_reasons bitmask (see DROP_REASONS). The rows are sorted by
+    received_dttm (see utils/time_index.py). The intervals in
+    INTERVAL_METRICS are added in minutes, with the valid_intervals bitmask
+    (see interval_valid). The columns get the types in CLEAN_SCHEMA, see
+    apply_schema for report_schema"""
+    "Drop rows"
+    # Drop rows that are cancelled or duplicates, have no on scene time, or
+    # have an unlikely response or transport time (more than 12 hours)
+    intervals, valid_intervals = get_interval_metrics(dat)
+    reasons = get_drop_reasons(dat, intervals)
+    keep = reasons == 0 if drop else None
+
     "Dropping columns"
-    # Drop the columns that are not needed
-    dat_clean = dat.drop(
+    # Only copy the rows and columns that are kept, with the rows sorted by the
+    # received time so time ranges can be sliced without copying, see
+    # utils/time_index.py
+    columns = dat.columns.drop(
         [
             "Box",
             "Original Priority",
@@ -125,23 +541,22 @@ def clean_data(dat: pd.DataFrame) -> pd.DataFrame:
             "Supervisor District",
             "Analysis Neighborhoods",
             "City",
-        ],
-        axis=1,
+            "case_location",
+        ]
     )
+    with stage("select rows", len(dat)) as s:
+        rows = sort_positions(dat["Received DtTm"], keep)
+        dat_clean = dat.iloc[rows, dat.columns.get_indexer(columns)]
+        s.rows_out = len(dat_clean)
 
     "Clean up the location column"
-    # extract the latitude and longitude from the case_location column and add them as seperate columns
-    location = dat_clean["case_location"].str.extract(r"\((.+)\)")
-    dat_clean["latitude"] = location[0].str.split(" ").str[0]
-    dat_clean["longitude"] = location[0].str.split(" ").str[1]
-    # convert the latitude and longitude columns to numeric
-    dat_clean["latitude"] = pd.to_numeric(dat_clean["latitude"])
-    dat_clean["longitude"] = pd.to_numeric(dat_clean["longitude"])
-    # drop the case_location column
-    dat_clean = dat_clean.drop(columns=["case_location"])
+    # case_location is "POINT (lon lat)", add the latitude and longitude as seperate columns
+    latitude, longitude = parse_points(dat["case_location"].to_numpy()[rows], "lonlat")
+    dat_clean["latitude"] = latitude
+    dat_clean["longitude"] = longitude
 
     "Rename columns"
-    dat_clean = dat_clean.rename(
+    dat_clean.rename(
         columns={
             "Call Number": "call_number",
             "Unit ID": "unit_id",
@@ -170,55 +585,211 @@ def clean_data(dat: pd.DataFrame) -> pd.DataFrame:
             "RowID": "row_id",
             "latitude": "latitude",
             "longitude": "longitude",
-        }
+        },
+        inplace=True,
     )
 
     """ Create a column for the hour of the day """
-    dat_clean["hour"] = dat_clean["received_dttm"].dt.hour
-    # create bins for the hour of the day
-    bins = [-1, 6, 12, 18, 24]
-    labels = ["Night", "Morning", "Afternoon", "Evening"]
-    dat_clean["period_of_day"] = pd.cut(dat_clean["hour"], bins=bins, labels=labels)
-
-    "Drop rows"
-    # Drop the rows with call_final_disposition == "Cancelled" or "Duplicate"
-    dat_clean = dat_clean.loc[
-        (dat_clean["call_final_disposition"] != "Cancelled")
-        & (dat_clean["call_final_disposition"] != "Duplicate")
-    ]
-
-    # Drop the rows with on_scene_dttm == NaT
-    dat_clean = dat_clean.loc[dat_clean["on_scene_dttm"].notna()]
+    with stage("period of day", len(dat_clean)):
+        dat_clean["hour"] = dat_clean["received_dttm"].dt.hour
+        # create bins for the hour of the day
+        bins = [-1, 6, 12, 18, 24]
+        labels = ["Night", "Morning", "Afternoon", "Evening"]
+        dat_clean["period_of_day"] = pd.cut(dat_clean["hour"], bins=bins, labels=labels)
 
     "Create time columns"
-    # Create a column for the response time in minutes
-    dat_clean["response_time"] = (
-        dat_clean["on_scene_dttm"] - dat_clean["received_dttm"]
-    ).dt.total_seconds() / 60
-
-    # Drop rows where response_time is unlikely
-    dat_clean = dat_clean.loc[dat_clean["response_time"] >= 0]
-    dat_clean = dat_clean.loc[dat_clean["response_time"] <= 720]
-
-    # Create a column for the transport time in minutes
-    dat_clean["transport_time"] = (
-        dat_clean["hospital_dttm"] - dat_clean["transport_dttm"]
-    ).dt.total_seconds() / 60
-
-    # Drop rows where transport_time is unlikely (keep rows with transport_time NaN)
-    dat_clean = dat_clean.loc[
-        (dat_clean["transport_time"] >= 0) | (dat_clean["transport_time"].isna())
-    ]
-    dat_clean = dat_clean.loc[
-        (dat_clean["transport_time"] <= 720) | (dat_clean["transport_time"].isna())
-    ]
-
+    # The intervals (response, transport, ...) in minutes, computed once
+    # above for all rows, and which of them are valid
+    for metric, minutes in intervals.items():
+        dat_clean[metric] = minutes[rows]
+    dat_clean["valid_intervals"] = valid_intervals[rows]
+    if not drop:
+        dat_clean["drop_reasons"] = reasons[rows]
+
+    "Compact types"
+    apply_schema(dat_clean, report=report_schema)
+
+    dat_clean.attrs["drop_counts"] = count_drop_reasons(reasons)
     return dat_clean
 
 
+# Types of the columns of the cleaned data, see apply_schema
+CLEAN_SCHEMA = {
+    "call_number": "int32",
+    "unit_id": "category",
+    "incident_number": "int32",
+    "call_type": "category",
+    "call_date": "datetime64[ns]",
+    "watch_date": "datetime64[ns]",
+    "received_dttm": "datetime64[ns]",
+    "entry_dttm": "datetime64[ns]",
+    "dispatch_dttm": "datetime64[ns]",
+    "response_dttm": "datetime64[ns]",
+    "on_scene_dttm": "datetime64[ns]",
+    "transport_dttm": "datetime64[ns]",
+    "hospital_dttm": "datetime64[ns]",
+    "call_final_disposition": "category",
+    "available_dttm": "datetime64[ns]",
+    "address": "category",
+    "battalion": "category",
+    "station_area": "category",
+    "Priority": "category",
+    "als_unit": "bool",
+    "call_type_group": "category",
+    "number_of_alarms": "int8",
+    "unit_type": "category",
+    "unit_sequence": "int16",
+    "neighborhood": "category",
+    "row_id": "string",
+    "latitude": "float32",
+    "longitude": "float32",
+    "hour": "int8",
+    "period_of_day": "category",
+    "response_time": "float32",
+    "transport_time": "float32",
+    "intake_time": "float32",
+    "queue_time": "float32",
+    "travel_time": "float32",
+    "turnout_time": "float32",
+    "hospital_time": "float32",
+    "busy_time": "float32",
+    "valid_intervals": "uint8",
+    "drop_reasons": "uint8",
+}
+
+
+@traced
+def apply_schema(
+    dat: pd.DataFrame, schema: dict = CLEAN_SCHEMA, report: bool = False
+) -> pd.DataFrame:
+    """Convert the columns of dat to the types in schema, in place. Columns that
+    are not in the schema are left as they are. Integer and bool columns with
+    missing values get the nullable type (Int32, boolean, ...) instead. Raises
+    a ValueError if an integer column has values that do not fit in its type.
+    If report is True the bytes before and after each conversion are stored
+    in dat.attrs["schema_savings"], as a dict with one entry per column"""
+    savings = {}
+    for column, dtype in schema.items():
+        if column not in dat.columns or dat[column].dtype == dtype:
+            continue
+        if dtype == "bool" or pd.api.types.is_integer_dtype(dtype):
+            if dat[column].isna().any():
+                dtype = "boolean" if dtype == "bool" else dtype.capitalize()
+        if pd.api.types.is_integer_dtype(dtype):
+            limits = np.iinfo(dtype.lower())
+            if dat[column].min() < limits.min or dat[column].max() > limits.max:
+                raise ValueError(f"Values of {column} do not fit in {dtype}")
+        converted = dat[column].astype(dtype)
+        if report:
+            before = dat[column].memory_usage(index=False, deep=True)
+            after = converted.memory_usage(index=False, deep=True)
+            savings[column] = {
+                "bytes_before": int(before),
+                "bytes_after": int(after),
+                "bytes_saved": int(before - after),
+            }
+        dat[column] = converted
+
+    if report:
+        dat.attrs["schema_savings"] = savings
+    return dat
+
+
+@traced
 def filter_data_years(dat: pd.DataFrame, year_from: int = 2017, year_to: int = 2023):
-    "Only keep data from year_from to year_to"
-    dat_clean = dat.copy()
-    dat_clean = dat_clean.loc[dat_clean["call_date"] < dt.datetime(year_to, 1, 1)]
-    dat_clean = dat_clean.loc[dat_clean["call_date"] >= dt.datetime(year_from, 1, 1)]
-    return dat_clean
+    """Only keep data received from year_from to year_to. The cleaned data is
+    sorted by received_dttm, so this is a slice of dat, not a copy, see
+    year_slice"""
+    return year_slice(dat, year_from, year_to)
+
+
+@traced
+def get_clean_data(
+    neighborhoods: dict = None, file_format: str = None, use_cache: bool = True
+) -> pd.DataFrame:
+    """The data from get_data after clean_data, with missing neighborhoods filled
+    in by fill_neighborhoods if neighborhoods is given. The result is cached on
+    disk, keyed on the contents of the data file, the neighborhoods and the
+    code of this module, so it is only cleaned again when one of them changes"""
+    file_format, path = _data_path(file_format)
+
+    def build():
+        dat = clean_data(get_data(file_format))
+        if neighborhoods is not None:
+            dat = fill_neighborhoods(dat, neighborhoods)
+        return dat
+
+    if not use_cache:
+        return build()
+    return cached_frame(clean_data_key(neighborhoods, file_format), build)
+
+
+def clean_data_key(neighborhoods: dict = None, file_format: str = None) -> str:
+    """Key of the data from get_clean_data in the cache, for the data file as
+    it is now"""
+    _, path = _data_path(file_format)
+    return cache_key(
+        data=hash_file(path),
+        neighborhoods=neighborhoods,
+        code=hash_code(__file__, geo.__file__, time_index.__file__),
+    )
+
+
+def concat_frames(frames: list) -> pd.DataFrame:
+    """Concatenate frames with the same columns, such as parts of the cleaned
+    data, with a new index. Categorical columns stay categorical, with the
+    categories of all frames"""
+    columns = {}
+    for column in frames[0].columns:
+        values = [frame[column] for frame in frames]
+        if isinstance(values[0].dtype, pd.CategoricalDtype):
+            combined = pd.api.types.union_categoricals(
+                [value.astype("category") for value in values], ignore_order=True
+            )
+            if values[0].cat.ordered:
+                combined = combined.as_ordered()
+            columns[column] = combined
+        else:
+            columns[column] = pd.concat(values, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+@traced
+def update_clean_data(
+    key: str, added: pd.DataFrame, replaced: pd.DataFrame, neighborhoods: dict = None
+):
+    """Update the data from get_clean_data cached under key, the clean_data_key
+    from before update_data, with the rows update_data added and replaced.
+    The result is cached under the key of the updated data file, so the
+    cleaned data is not built again from all rows. Only the added and
+    replaced rows are cleaned, and the drop counts and neighborhood check in
+    attrs are updated with theirs. Returns the added and replaced rows after
+    clean_data and fill_neighborhoods (if neighborhoods is given), e.g. to
+    update the cube with. Nothing is cached if there is nothing under key"""
+
+    def clean(dat):
+        dat = clean_data(dat)
+        if neighborhoods is not None:
+            dat = fill_neighborhoods(dat, neighborhoods)
+        return dat
+
+    added, removed = clean(added), clean(replaced)
+    dat_old = load_cached(key)
+    if dat_old is None:
+        return added, removed
+
+    # The rows are cleaned one by one, so the cleaned data of the updated file
+    # is the old cleaned data without the replaced rows, plus the new rows
+    kept = ~dat_old["row_id"].isin(replaced["RowID"]).to_numpy()
+    dat = apply_schema(concat_frames([dat_old.loc[kept], added]))
+    if not is_time_sorted(dat):
+        dat = dat.iloc[sort_positions(dat["received_dttm"])].reset_index(drop=True)
+    dat.attrs = {
+        name: {
+            count: value + added.attrs[name][count] - removed.attrs[name][count]
+            for count, value in counts.items()
+        }
+        for name, counts in dat_old.attrs.items()
+    }
+    save_cached(clean_data_key(neighborhoods), dat)
+    return added, removed
@@ -0,0 +1,182 @@
+""" Importing packages """
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Local
+from utils.trace import stage, traced
+
+# Smallest number of distinct strings worth sending to another process
+MIN_STRINGS_PER_JOB = 50000
+
+# Width of the fixed-width directives the fast parser understands
+DIRECTIVE_WIDTHS = {"m": 2, "d": 2, "Y": 4, "H": 2, "I": 2, "M": 2, "S": 2, "p": 2}
+NAT = np.iinfo(np.int64).min
+
+
+def _split_format(date_format: str):
+    """Split a format into (directive or None, position, literal) tokens. Returns
+    None if the format has directives that are not fixed width"""
+    tokens = []
+    position = 0
+    i = 0
+    while i < len(date_format):
+        if date_format[i] == "%":
+            directive = date_format[i + 1 : i + 2]
+            if directive not in DIRECTIVE_WIDTHS:
+                return None
+            tokens.append((directive, position, None))
+            position += DIRECTIVE_WIDTHS[directive]
+            i += 2
+        else:
+            tokens.append((None, position, date_format[i]))
+            position += 1
+            i += 1
+    return tokens, position
+
+
+def _parse_fixed_width(strings: np.ndarray, date_format: str):
+    """Vectorized parsing of zero padded strings such as "01/31/2015 08:05:09 PM".
+    Returns nanoseconds since epoch and a mask of the strings that were parsed.
+    Strings that do not match the format exactly are left for pd.to_datetime."""
+    split = _split_format(date_format)
+    parsed = np.zeros(len(strings), dtype=bool)
+    nanoseconds = np.full(len(strings), NAT)
+    if split is None or len(strings) == 0:
+        return nanoseconds, parsed
+    tokens, width = split
+    try:
+        # One extra byte so that too long strings can be spotted
+        chars = np.array(strings, dtype=f"S{width + 1}")
+    except (UnicodeEncodeError, TypeError, ValueError):
+        return nanoseconds, parsed
+    chars = chars.view(np.uint8).reshape(len(strings), width + 1)
+
+    ok = chars[:, width] == 0
+    fields = {}
+    for directive, position, literal in tokens:
+        if directive is None:
+            ok &= chars[:, position] == ord(literal)
+        elif directive == "p":
+            ok &= (chars[:, position] == ord("A")) | (chars[:, position] == ord("P"))
+            ok &= chars[:, position + 1] == ord("M")
+            fields["p"] = chars[:, position] == ord("P")
+        else:
+            digits = chars[:, position : position + DIRECTIVE_WIDTHS[directive]]
+            digits = digits.astype(np.int64) - ord("0")
+            ok &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+            value = np.zeros(len(strings), dtype=np.int64)
+            for column in range(digits.shape[1]):
+                value = value * 10 + digits[:, column]
+            fields[directive] = value
+
+    if not {"Y", "m", "d"} <= fields.keys():
+        return nanoseconds, parsed
+
+    # Hours as strptime reads them, %p only matters together with %I
+    hour = np.zeros(len(strings), dtype=np.int64)
+    if "H" in fields:
+        hour = fields["H"]
+        ok &= hour <= 23
+    elif "I" in fields:
+        hour = fields["I"]
+        ok &= (hour >= 1) & (hour <= 12)
+        hour = hour % 12
+        if "p" in fields:
+            hour = hour + 12 * fields["p"]
+    minute = fields.get("M", 0)
+    second = fields.get("S", 0)
+    ok &= (np.asarray(minute) <= 59) & (np.asarray(second) <= 59)
+
+    # Years outside the nanosecond range are left for pd.to_datetime
+    year, month, day = fields["Y"], fields["m"], fields["d"]
+    ok &= (year >= 1678) & (year <= 2261) & (month >= 1) & (month <= 12)
+    year, month, day = year[ok], month[ok], day[ok]
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    month_start = months.astype("datetime64[D]").astype(np.int64)
+    month_end = (months + 1).astype("datetime64[D]").astype(np.int64)
+    valid_day = (day >= 1) & (day <= month_end - month_start)
+    ok[ok] = valid_day
+
+    seconds = (month_start + day - 1)[valid_day] * 86400 + (
+        hour * 3600 + np.asarray(minute) * 60 + np.asarray(second)
+    )[ok]
+    nanoseconds[ok] = seconds * 1000000000
+    return nanoseconds, ok
+
+
+def _parse_strings(strings: np.ndarray, date_format: str) -> np.ndarray:
+    """Parse an array of distinct strings, returning nanoseconds since epoch"""
+    nanoseconds, parsed = _parse_fixed_width(strings, date_format)
+    if not parsed.all():
+        # Everything the fast parser did not handle, including invalid strings
+        # which raise the same error as before
+        nanoseconds[~parsed] = pd.to_datetime(
+            strings[~parsed], format=date_format, cache=False
+        ).asi8
+    return nanoseconds
+
+
+@traced
+def parse_date_columns(
+    dat: pd.DataFrame, formats: dict, n_jobs: int = None
+) -> pd.DataFrame:
+    """Convert the columns of dat in formats (column name -> date format) to
+    datetime. Gives the same result as calling pd.to_datetime on each column,
+    but every distinct string of a column is only parsed once, since the
+    timestamps repeat across the units of an incident. The columns are parsed
+    by n_jobs processes (all cores by default)."""
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    # Columns that are already converted are left as they are
+    formats = {
+        column: date_format
+        for column, date_format in formats.items()
+        if not pd.api.types.is_datetime64_dtype(dat[column])
+    }
+
+    # Find the distinct strings of each column and split them into jobs
+    codes = {}
+    jobs = []
+    for column, date_format in formats.items():
+        with stage(f"factorize {column}", len(dat)) as s:
+            codes[column], uniques = pd.factorize(dat[column].to_numpy())
+            s.rows_out = len(uniques)
+        n_splits = max(1, min(n_jobs, len(uniques) // MIN_STRINGS_PER_JOB))
+        for part in np.array_split(uniques, n_splits):
+            jobs.append((column, part, date_format))
+
+    # Parse the distinct strings, in parallel if it is worth it
+    if n_jobs > 1 and len(jobs) > 1 and len(dat) >= MIN_STRINGS_PER_JOB:
+        n_strings = sum(len(part) for _, part, _ in jobs)
+        with stage("parse in processes", n_strings), ProcessPoolExecutor(
+            max_workers=min(n_jobs, len(jobs))
+        ) as executor:
+            futures = [
+                executor.submit(_parse_strings, part, date_format)
+                for _, part, date_format in jobs
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = []
+        for column, part, date_format in jobs:
+            with stage(f"parse {column}", len(part)):
+                results.append(_parse_strings(part, date_format))
+
+    parsed = {}
+    for (column, _, _), result in zip(jobs, results):
+        parsed.setdefault(column, []).append(result)
+
+    # Map the parsed strings back to the rows of each column
+    for column in formats:
+        with stage(f"map back {column}", len(dat)):
+            values = np.concatenate(parsed[column])
+            # Missing values have code -1 and become NaT
+            nanoseconds = np.full(len(dat), NAT)
+            found = codes[column] >= 0
+            nanoseconds[found] = values[codes[column][found]]
+            dat[column] = nanoseconds.view("datetime64[ns]")
+
+    return dat
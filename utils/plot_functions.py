@@ -1,58 +1,67 @@
 """ Importing packages """
 from math import pi
+import numpy as np
 import pandas as pd
-import plotly.express as px
-from typing import List
-import calplot
-import seaborn as sns
+from typing import List, TYPE_CHECKING
 
-# Bokeh
-from bokeh.models import TabPanel, Tabs
-from bokeh.models import ColumnDataSource, Legend, HoverTool
-from bokeh.plotting import figure
-from bokeh.io import output_file, output_notebook
+# The plotting backends (plotly, bokeh, calplot and seaborn) are slow to import,
+# so each function imports the one it needs when it is first called
+if TYPE_CHECKING:
+    from bokeh.plotting import figure
 
 # Local
-from utils.help_functions import get_viridis_pallette, format_string
+from utils.help_functions import get_viridis_pallette, format_string, lttb
 from utils.const import FILTER_CALL_TYPES
+from utils.cube import daily_series, group_mean, is_daily
+from utils.sketch import box_stats, is_sketch
+from utils.time_index import TIME_COLUMN, time_slice, years_to_range
+from utils.trace import stage, traced
 
 
+@traced
 def make_map(
     dat: pd.DataFrame,
     neighborhoods: dict,
     column_to_plot: str = "response_time",
 ):
-    """Plotting a map of San Fransisco showing average response time for each neighborhood"""
-    mean_response = (
-        dat.groupby("neighborhood", as_index=False)[column_to_plot]
-        .mean()
-        .rename(
-            columns={
-                "neighborhood": "Neighborhood",
-            }
+    """Plotting a map of San Fransisco showing average response time for each neighborhood.
+    dat can be the cleaned data or a cube from build_cube"""
+    import plotly.express as px
+
+    with stage("mean per neighborhood", len(dat)) as s:
+        mean_response = (
+            group_mean(dat, "neighborhood", column_to_plot)
+            .reset_index()
+            .rename(
+                columns={
+                    "neighborhood": "Neighborhood",
+                }
+            )
         )
-    )
-
-    fig = px.choropleth_mapbox(
-        mean_response,
-        geojson=neighborhoods,
-        locations="Neighborhood",
-        color=column_to_plot,
-        color_continuous_scale="Viridis",
-        range_color=(
-            min(mean_response[column_to_plot]),
-            max(mean_response[column_to_plot]),
-        ),
-        mapbox_style="carto-positron",
-        zoom=11,
-        center={"lat": 37.773972, "lon": -122.431297},
-        opacity=0.5,
-        labels={column_to_plot: format_string(column_to_plot)},
-    )
-    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+        s.rows_out = len(mean_response)
+
+    with stage("draw map", len(mean_response)):
+        fig = px.choropleth_mapbox(
+            mean_response,
+            geojson=neighborhoods,
+            locations="Neighborhood",
+            color=column_to_plot,
+            color_continuous_scale="Viridis",
+            range_color=(
+                min(mean_response[column_to_plot]),
+                max(mean_response[column_to_plot]),
+            ),
+            mapbox_style="carto-positron",
+            zoom=11,
+            center={"lat": 37.773972, "lon": -122.431297},
+            opacity=0.5,
+            labels={column_to_plot: format_string(column_to_plot)},
+        )
+        fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
     return fig
 
 
+@traced
 def make_bokeh_line_plot(
     dat: pd.DataFrame,
     filter_call_types: list = FILTER_CALL_TYPES,
@@ -61,24 +70,40 @@ def make_bokeh_line_plot(
     y_var: str = "response_time",
     x_range: tuple = (2017, 2022),
     init_legend_items: List[str] = [],
+    max_points: int = None,
 ):
-    dat_fire = dat[dat["call_type"].isin(filter_call_types)]
-    dat_fire = dat_fire[dat_fire[color_var].notna()]
-    dat_fire["x_variable"] = dat_fire[x_var]
-    dat_fire["y_variable"] = dat_fire[y_var]
-
-    res = (
-        dat_fire.groupby([color_var, "x_variable"])["y_variable"]
-        .mean()
-        .reset_index(name="mean")
-    )
-    processed_dat = res.pivot(
-        index="x_variable", columns=color_var, values="mean"
-    ).reset_index()
+    """Line plot of the mean of y_var over x_var with a line for each value of
+    color_var. dat can be the cleaned data or a cube from build_cube. Lines
+    with more than max_points points are downsampled to max_points with
+    lttb, keeping their shape"""
+    from bokeh.models import ColumnDataSource, Legend
+    from bokeh.plotting import figure
+
+    with stage("mean per line", len(dat)) as s:
+        dat_fire = dat[
+            dat["call_type"].isin(filter_call_types) & dat[color_var].notna()
+        ]
+        descripts = [d for d in list(dat_fire[color_var].unique()) if not pd.isna(d)]
+
+        # Table of the means with a row per color and a column per x value,
+        # filled from the integer codes of both
+        means = group_mean(dat_fire, [color_var, x_var], y_var)
+        color_codes = pd.Index(descripts).get_indexer(means.index.get_level_values(0))
+        x_values, x_codes = np.unique(
+            means.index.get_level_values(1).to_numpy(), return_inverse=True
+        )
+        table = np.full((len(descripts), len(x_values)), np.nan, dtype=np.float32)
+        table[color_codes, x_codes] = means.to_numpy()
+        s.rows_out = len(means)
+
+    # Typed arrays are embedded in the HTML in binary, datetimes as the
+    # milliseconds bokeh uses
+    if np.issubdtype(x_values.dtype, np.datetime64):
+        x_values = x_values.astype("datetime64[ms]").astype(np.int64)
+        x_values = x_values.astype(np.float64)
+    elif np.issubdtype(x_values.dtype, np.integer):
+        x_values = x_values.astype(np.int32)
 
-    descripts = [d for d in list(dat_fire[color_var].unique()) if not pd.isna(d)]
-    src = ColumnDataSource(processed_dat)
-    src.column_names
     viridis = get_viridis_pallette(len(descripts))
     p = figure(
         x_range=x_range,
@@ -99,7 +124,19 @@ def make_bokeh_line_plot(
     if len(init_legend_items) < 1:
         init_legend_items = [descripts[0]]
 
+    # All lines share one source, unless they are downsampled and each keeps
+    # different points
+    downsample = max_points is not None and len(x_values) > max_points
+    if not downsample:
+        src = ColumnDataSource({"x_variable": x_values, **dict(zip(descripts, table))})
+
     for indx, i in enumerate(descripts):
+        if downsample:
+            present = ~np.isnan(table[indx])
+            x, y = x_values[present], table[indx][present]
+            keep = lttb(x, y, max_points)
+            src = ColumnDataSource({"x_variable": x[keep], i: y[keep]})
+
         ### Create a line for each district
         lines[i] = p.line(
             x="x_variable",
@@ -129,34 +166,58 @@ def make_bokeh_line_plot(
     return p
 
 
+@traced
 def make_cal_plot(
     dat: pd.DataFrame,
     filter_call_types: list = ["Medical Incident"],
     filter_years: list = range(2017, 2023),
     column_name: str = "response_time",
+    time_range: tuple = None,
 ):
-    caldat = dat.copy()
-    caldat = caldat[caldat["call_type"].isin(filter_call_types)]
-    caldat = caldat[caldat["received_dttm"].dt.year.isin(filter_years)]
-    # Select the relevant columns ("received_dttm" and column_name)
-    caldat = caldat[["received_dttm", column_name]]
-    # Set the index to be the date
-    caldat = caldat.set_index("received_dttm")
+    """Calendar plot of the daily mean of column_name. dat can be the cleaned
+    data, a cube from build_cube or a daily series from daily_series. A daily
+    series is already limited to its call types, so filter_call_types is not
+    used for it, and it can be reused for the calendars of several columns.
+    The days plotted are those in time_range (start, end), or else in
+    filter_years. The cleaned data is sliced to them before it is aggregated,
+    see time_slice"""
+    import calplot
+
+    if time_range is None:
+        time_range = years_to_range(filter_years)
+    with stage("daily means", len(dat)) as s:
+        if not is_daily(dat):
+            if time_range is not None and TIME_COLUMN in dat.columns:
+                dat = time_slice(dat, *time_range)
+            dat = daily_series(dat, filter_call_types, [column_name])
+        if time_range is not None:
+            caldat = time_slice(dat, *time_range)
+        elif filter_years is not None:
+            caldat = dat[dat.index.year.isin(filter_years)]
+        else:
+            caldat = dat
+        count = caldat[f"{column_name}_count"].replace(0, np.nan)
+        caldat = (caldat[f"{column_name}_sum"] / count).rename(column_name)
+        s.rows_out = len(caldat)
     # Make the plot
-    fig, ax = calplot.calplot(
-        data=caldat[column_name],
-        how="mean",
-        cmap="YlGnBu",
-        # fillcolor="grey",
-        suptitle=format_string(column_name),
-        linewidth=0.2,
-    )
+    with stage("draw calendar", len(caldat)):
+        fig, ax = calplot.calplot(
+            data=caldat,
+            how="mean",
+            cmap="YlGnBu",
+            # fillcolor="grey",
+            suptitle=format_string(column_name),
+            linewidth=0.2,
+        )
 
     return fig
 
 
-def make_bokeh_tabs(figs: List[figure]):
+@traced
+def make_bokeh_tabs(figs: List["figure"]):
     """Creates a tabbed layout of bokeh figures"""
+    from bokeh.models import TabPanel, Tabs
+
     # Set tab titles as the figure titles
     tabs = [TabPanel(child=fig, title=fig.title.text) for fig in figs]
     # Create a Tabs layout
@@ -164,16 +225,49 @@ def make_bokeh_tabs(figs: List[figure]):
     return tabs
 
 
+@traced
 def make_boxplot(
     dat: pd.DataFrame,
     filter_call_types: list = ["Medical Incident"],
     filter_years: list = None,
     x_var: str = "neighborhood",
     y_var: str = "response_time",
+    time_range: tuple = None,
 ):
+    """Box plot of y_var for each value of x_var. dat can be the cleaned data or
+    a sketch of y_var from build_sketch with call_type, x_var and (to filter
+    on years) Year among its groups, in which case the boxes are drawn from
+    the sketch's quantiles instead of sorting all rows. The cleaned data can
+    be limited to time_range (start, end) or filter_years, and is sliced to
+    them by received_dttm (see time_slice). A sketch can only be limited to
+    filter_years"""
+    if is_sketch(dat):
+        import matplotlib.pyplot as plt
+
+        if time_range is not None:
+            raise ValueError("A sketch can only be filtered on filter_years")
+
+        plot_dat = dat[dat["call_type"].isin(filter_call_types) & dat[x_var].notna()]
+        if filter_years:
+            plot_dat = plot_dat[plot_dat["Year"].isin(filter_years)]
+        with stage("box stats", len(plot_dat)) as s:
+            stats = box_stats(plot_dat, x_var)
+            s.rows_out = len(stats)
+        b = plt.gca()
+        b.bxp(stats, showfliers=False)
+        b.set(xlabel=format_string(x_var), ylabel=format_string(y_var))
+        b.tick_params(axis="x", labelrotation=90)
+        return b
+
+    import seaborn as sns
+
+    if time_range is None:
+        time_range = years_to_range(filter_years)
+    if time_range is not None:
+        dat = time_slice(dat, *time_range)
+    elif filter_years:
+        dat = dat[dat[TIME_COLUMN].dt.year.isin(filter_years)]
     plot_dat = dat[dat["call_type"].isin(filter_call_types)]
-    if filter_years:
-        plot_dat = plot_dat[plot_dat["received_dttm"].dt.year.isin(filter_years)]
     b = sns.boxplot(data=plot_dat, x=x_var, y=y_var, showfliers=False)
     b.set(xlabel=format_string(x_var), ylabel=format_string(y_var))
     b.set_xticklabels(b.get_xticklabels(), rotation=90)
@@ -181,9 +275,13 @@ def make_boxplot(
     return b
 
 
+@traced
 def plot_importance(
     column_names: List[str], importances: List[float], title="Importance of Features"
 ):
+    from bokeh.models import ColumnDataSource, HoverTool
+    from bokeh.plotting import figure
+
     # Create a dataframe from the feature importances
     feature_importances = pd.DataFrame(
         {"feature": column_names, "importance": importances}
@@ -221,9 +319,12 @@ def plot_importance(
     return p
 
 
+@traced
 def plot_importance2(importance_df: pd.DataFrame, top_n: int = 10):
     """Plot the top_n most important features from a dataframe of feature importances
     where the column names denote the method used to calculate the importance."""
+    from bokeh.models import ColumnDataSource
+    from bokeh.plotting import figure
 
     plot_data = importance_df.reset_index().rename(columns={"index": "Feature"})
     plot_data = plot_data.dropna(axis=1, how="all")
@@ -0,0 +1,142 @@
+""" Importing packages """
+import numpy as np
+import pandas as pd
+
+# Quantiles from a sketch are within this relative error of the true values
+RELATIVE_ACCURACY = 0.01
+# Bucket of the values that are zero
+ZERO_BUCKET = np.iinfo(np.int32).min
+
+
+def _gamma(relative_accuracy: float) -> float:
+    return (1 + relative_accuracy) / (1 - relative_accuracy)
+
+
+def build_sketch(
+    dat: pd.DataFrame,
+    by: list,
+    column: str = "response_time",
+    relative_accuracy: float = RELATIVE_ACCURACY,
+) -> pd.DataFrame:
+    """Quantile sketch of column for each group of the columns in by. Values are
+    counted in logarithmic buckets, bucket i holding the values in
+    (gamma^(i-1), gamma^i], so any quantile can be read back within
+    relative_accuracy. The sketch is a frame with the by columns, the bucket
+    and the count. Sketches of parts of the data, e.g. chunks of a file, can be
+    combined with merge_sketches. Missing values are left out."""
+    value = dat[column].to_numpy(dtype=np.float64)
+    if (value < 0).any():
+        raise ValueError(f"{column} has negative values")
+    valid = ~np.isnan(value)
+
+    bucket = np.full(len(value), ZERO_BUCKET, dtype=np.int32)
+    positive = valid & (value > 0)
+    bucket[positive] = np.ceil(
+        np.log(value[positive]) / np.log(_gamma(relative_accuracy))
+    )
+
+    sketch = dat.loc[valid, list(by)].reset_index(drop=True)
+    sketch["bucket"] = bucket[valid]
+    return (
+        sketch.groupby(list(by) + ["bucket"], observed=True, dropna=False)
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+
+
+def merge_sketches(sketches: list, by: list) -> pd.DataFrame:
+    """Combine sketches of parts of the data made with the same relative
+    accuracy, optionally to fewer groups than they were built with"""
+    return (
+        pd.concat(sketches, ignore_index=True)
+        .groupby(list(by) + ["bucket"], observed=True, dropna=False)["count"]
+        .sum()
+        .reset_index()
+    )
+
+
+def is_sketch(dat: pd.DataFrame) -> bool:
+    """Is dat a sketch from build_sketch rather than row level data"""
+    return "bucket" in dat.columns and "count" in dat.columns
+
+
+def _bucket_values(bucket: np.ndarray, relative_accuracy: float) -> np.ndarray:
+    """The value that represents each bucket"""
+    gamma = _gamma(relative_accuracy)
+    values = 2 * gamma ** bucket.astype(np.float64) / (gamma + 1)
+    return np.where(bucket == ZERO_BUCKET, 0.0, values)
+
+
+def _sorted_groups(sketch: pd.DataFrame, by: list):
+    """The sketch merged to the by groups and sorted by group and bucket, with
+    the position where each group starts"""
+    sketch = merge_sketches([sketch], by).sort_values(list(by) + ["bucket"])
+    sketch = sketch.reset_index(drop=True)
+    if by:
+        starts = np.flatnonzero(
+            sketch.groupby(by, observed=True, dropna=False, sort=False)
+            .cumcount()
+            .to_numpy()
+            == 0
+        )
+    else:
+        starts = np.array([0])
+    return sketch, starts
+
+
+def sketch_quantiles(
+    sketch: pd.DataFrame,
+    by: list,
+    quantiles: list = [0.5, 0.9, 0.95],
+    relative_accuracy: float = RELATIVE_ACCURACY,
+) -> pd.DataFrame:
+    """Quantiles of each group of the columns in by (which can be fewer than the
+    sketch was built with) from a sketch from build_sketch. Returns a frame
+    with a row per group, a column per quantile and the count"""
+    sketch, starts = _sorted_groups(sketch, by)
+    counts = sketch["count"].to_numpy()
+    cumulative = np.cumsum(counts)
+    ends = np.append(starts[1:], len(sketch))
+    before = cumulative[starts] - counts[starts]
+    totals = cumulative[ends - 1] - before
+    values = _bucket_values(sketch["bucket"].to_numpy(), relative_accuracy)
+
+    result = sketch.iloc[starts][list(by)].reset_index(drop=True)
+    for q in quantiles:
+        # Position of the first bucket whose cumulative count passes the rank
+        rank = before + np.floor(q * (totals - 1))
+        result[q] = values[np.searchsorted(cumulative, rank, side="right")]
+    result["count"] = totals
+    return result.set_index(list(by)) if by else result
+
+
+def box_stats(
+    sketch: pd.DataFrame, by: str, relative_accuracy: float = RELATIVE_ACCURACY
+) -> list:
+    """Box plot statistics of each group of the column by, in the format of
+    matplotlib's Axes.bxp. The whiskers reach the most extreme values within
+    1.5 times the interquartile range of the box, as in seaborn"""
+    quantiles = sketch_quantiles(sketch, [by], [0.25, 0.5, 0.75], relative_accuracy)
+    sketch, starts = _sorted_groups(sketch, [by])
+    values = _bucket_values(sketch["bucket"].to_numpy(), relative_accuracy)
+    ends = np.append(starts[1:], len(sketch))
+
+    stats = []
+    for (label, row), start, end in zip(quantiles.iterrows(), starts, ends):
+        group = values[start:end]
+        iqr = row[0.75] - row[0.25]
+        low = group[group >= row[0.25] - 1.5 * iqr]
+        high = group[group <= row[0.75] + 1.5 * iqr]
+        stats.append(
+            {
+                "label": label,
+                "q1": row[0.25],
+                "med": row[0.5],
+                "q3": row[0.75],
+                "whislo": low.min() if len(low) else row[0.25],
+                "whishi": high.max() if len(high) else row[0.75],
+                "fliers": [],
+            }
+        )
+    return stats
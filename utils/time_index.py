@@ -0,0 +1,78 @@
+""" Importing packages """
+import numpy as np
+import pandas as pd
+
+# The cleaned data is sorted by this column, see clean_data
+TIME_COLUMN = "received_dttm"
+
+
+def _times(dat: pd.DataFrame, column: str) -> np.ndarray:
+    """The datetime64 values of column, or of the index if dat has no such
+    column and a DatetimeIndex (as a daily series from daily_series)"""
+    if column in dat.columns:
+        return dat[column].to_numpy(dtype="datetime64[ns]")
+    if isinstance(dat.index, pd.DatetimeIndex):
+        return dat.index.to_numpy(dtype="datetime64[ns]")
+    raise KeyError(f"{column} is not a column of the data")
+
+
+def sort_positions(times: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+    """Positions of rows (all rows if None, else a boolean mask or positions)
+    sorted by times, keeping the order of equal times"""
+    times = np.asarray(times, dtype="datetime64[ns]")
+    if rows is None:
+        rows = np.arange(len(times))
+    elif rows.dtype == bool:
+        rows = np.flatnonzero(rows)
+    return rows[np.argsort(times[rows], kind="stable")]
+
+
+def is_time_sorted(dat: pd.DataFrame, column: str = TIME_COLUMN) -> bool:
+    """Is dat sorted by column (or its DatetimeIndex)"""
+    times = _times(dat, column).view(np.int64)
+    return bool(np.all(times[1:] >= times[:-1]))
+
+
+def time_slice(
+    dat: pd.DataFrame, start=None, end=None, column: str = TIME_COLUMN
+) -> pd.DataFrame:
+    """Rows of dat from start (included) to end (not included), any of them
+    can be None for no limit. If dat is sorted by column (or its
+    DatetimeIndex), as the cleaned data is, the rows are found by binary
+    search and returned as a slice of dat without copying it. Otherwise they
+    are found with a mask over every row."""
+    times = _times(dat, column)
+    start = None if start is None else np.datetime64(pd.Timestamp(start), "ns")
+    end = None if end is None else np.datetime64(pd.Timestamp(end), "ns")
+    if not is_time_sorted(dat, column):
+        keep = np.ones(len(dat), dtype=bool)
+        if start is not None:
+            keep &= times >= start
+        if end is not None:
+            keep &= times < end
+        return dat[keep]
+
+    first = 0 if start is None else np.searchsorted(times, start, side="left")
+    last = len(dat) if end is None else np.searchsorted(times, end, side="left")
+    return dat.iloc[first:last]
+
+
+def years_to_range(years) -> tuple:
+    """The time range (start, end) of consecutive years such as range(2017, 2023),
+    None if years is None or has gaps"""
+    if years is None:
+        return None
+    years = sorted(set(int(year) for year in years))
+    if not years or years[-1] - years[0] != len(years) - 1:
+        return None
+    return pd.Timestamp(years[0], 1, 1), pd.Timestamp(years[-1] + 1, 1, 1)
+
+
+def year_slice(
+    dat: pd.DataFrame, year_from: int, year_to: int, column: str = TIME_COLUMN
+) -> pd.DataFrame:
+    """Rows of dat from the start of year_from to the start of year_to, see
+    time_slice"""
+    return time_slice(
+        dat, pd.Timestamp(year_from, 1, 1), pd.Timestamp(year_to, 1, 1), column
+    )
@@ -0,0 +1,216 @@
+""" Importing packages """
+import atexit
+import functools
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+import pandas as pd
+
+# Local
+from utils.const import TRACE_ENV
+
+# Tracing is off unless enabled, then every stage adds a record to _records.
+# _stack holds the stages that are running, innermost last
+_enabled = False
+_records = []
+_stack = []
+_started = itertools.count()
+
+
+class _Stage:
+    """A running stage. Set rows_out (and rows_in if not given) on it inside
+    the with block"""
+
+    def __init__(self, name: str, rows_in: int = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            # The peak is reset for this stage, keep the enclosing stage's
+            _stack[-1].peak = max(_stack[-1].peak, peak)
+        tracemalloc.reset_peak()
+        self.memory_start = self.peak = current
+        self.depth = len(_stack)
+        # Path of the stage through the stages it is nested in
+        self.path = f"{_stack[-1].path}/{self.name}" if _stack else self.name
+        self.order = next(_started)
+        _stack.append(self)
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        _stack.pop()
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, self.peak)
+        _records.append(
+            {
+                "name": self.name,
+                "path": self.path,
+                "order": self.order,
+                "depth": self.depth,
+                "wall_s": wall,
+                "cpu_s": cpu,
+                "peak_mb": (self.peak - self.memory_start) / 1024**2,
+                "rows_in": self.rows_in,
+                "rows_out": self.rows_out,
+            }
+        )
+
+
+class _NullStage:
+    """Stands in for _Stage when tracing is off, ignores everything"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, rows_in: int = None):
+    """Context manager recording the wall time, CPU time, peak memory (of the
+    Python and numpy allocations, over the memory at the start) and rows of
+    the named stage, if tracing is enabled:
+
+        with stage("clean_data.drop_rows", len(dat)) as s:
+            ...
+            s.rows_out = len(dat_clean)
+
+    Stages can be nested. When tracing is off it does nothing."""
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, rows_in)
+
+
+def _rows(value) -> int:
+    """Number of rows of a frame, series or array, None for anything else"""
+    shape = getattr(value, "shape", ())
+    return int(shape[0]) if len(shape) else None
+
+
+def traced(function=None, name: str = None):
+    """Decorator recording each call of a function as a stage (see stage), named
+    after the function unless name is given. The rows in are those of the
+    first argument, the rows out those of the result."""
+    if function is None:
+        return functools.partial(traced, name=name)
+    stage_name = name or function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        with _Stage(stage_name, _rows(args[0]) if args else None) as s:
+            result = function(*args, **kwargs)
+            s.rows_out = _rows(result)
+        return result
+
+    return wrapper
+
+
+def enable():
+    """Start recording stages, and tracing the memory allocations"""
+    global _enabled
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    """Stop recording stages"""
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def get_trace() -> list:
+    """The recorded stages, in the order they finished"""
+    return list(_records)
+
+
+def add_trace(records: list):
+    """Add stages recorded elsewhere, e.g. in a worker process. They are
+    numbered as starting now, in the order they started there"""
+    for record in sorted(records, key=lambda record: record["order"]):
+        _records.append({**record, "order": next(_started)})
+
+
+def clear_trace():
+    _records.clear()
+
+
+def write_trace(path: str):
+    """Write the recorded stages to a json file"""
+    with open(path, "w") as f:
+        json.dump({"pid": os.getpid(), "stages": _records}, f, indent=2)
+
+
+def trace_summary() -> pd.DataFrame:
+    """Recorded stages added up by path, with the stages nested in a stage
+    indented under it, in the order they first started"""
+    if not _records:
+        return pd.DataFrame()
+    trace = pd.DataFrame(_records)
+    summary = trace.groupby("path", sort=False).agg(
+        name=("name", "first"),
+        depth=("depth", "first"),
+        first=("order", "min"),
+        calls=("name", "size"),
+        wall_s=("wall_s", "sum"),
+        cpu_s=("cpu_s", "sum"),
+        peak_mb=("peak_mb", "max"),
+        rows_in=("rows_in", lambda rows: rows.sum(min_count=1)),
+        rows_out=("rows_out", lambda rows: rows.sum(min_count=1)),
+    )
+
+    # Sort by when each enclosing stage and then the stage itself first started
+    def tree_order(path):
+        parts = path.split("/")
+        prefixes = ["/".join(parts[: i + 1]) for i in range(len(parts))]
+        return [(summary["first"].get(prefix, -1), prefix) for prefix in prefixes]
+
+    summary = summary.loc[sorted(summary.index, key=tree_order)]
+    summary.index = ["  " * d + n for n, d in zip(summary["name"], summary["depth"])]
+    summary.index.name = "stage"
+    return summary[["calls", "wall_s", "cpu_s", "peak_mb", "rows_in", "rows_out"]]
+
+
+def print_summary(file=sys.stderr):
+    summary = trace_summary()
+    if len(summary):
+        print(summary.round(3).to_string(), file=file)
+
+
+def _report_at_exit(path: str):
+    print_summary()
+    if path:
+        write_trace(path)
+
+
+# FIRE_TRACE=1 prints a summary of the stages when the program ends, any other
+# value (except 0) is a path to also write the trace to as json
+if os.environ.get(TRACE_ENV, "0") not in ["", "0"]:
+    enable()
+    _path = os.environ[TRACE_ENV]
+    atexit.register(_report_at_exit, None if _path == "1" else _path)